@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+bench_redaction.py
+Reproducible benchmark of the redaction hot path of filtered_logger
+(filter_datum and RedactingFormatter.format, with the regex and the
+scanner backends) on synthetic rows shaped like user_data.csv. Results can
+be saved as a baseline and later runs compared against it:
+    ./bench_redaction.py --save baseline.json
+    ./bench_redaction.py --compare baseline.json --threshold 0.2
+"""
+import argparse
+import itertools
+import json
+import logging
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional, Sequence
+
+from filtered_logger import PII_FIELDS, RedactingFormatter, filter_datum
+
+SEED = 1986
+FIELD_COUNTS = (5, 20, 50)
+MESSAGE_LENGTHS = (128, 1024)
+SEPARATORS = (";", "|")
+MATCH_RATES = (0.0, 0.5, 1.0)
+ROWS = 64
+REPEAT = 5
+
+
+def synthetic_row(rng: random.Random, length: int) -> Dict[str, str]:
+    """
+    Return one user_data.csv-like row; the user agent is padded so that the
+    rendered message is about `length` characters long.
+    """
+    first = "".join(rng.choice("abcdefghij") for _ in range(6)).title()
+    row = {
+        "name": "{} {}".format(first, first[::-1].title()),
+        "email": "{}@example.com".format(first.lower()),
+        "phone": "({}) {}-{}".format(rng.randint(100, 999),
+                                     rng.randint(100, 999),
+                                     rng.randint(1000, 9999)),
+        "ssn": "{}-{}-{}".format(rng.randint(100, 999), rng.randint(10, 99),
+                                 rng.randint(1000, 9999)),
+        "password": "".join(rng.choice("^~?&#Kz9") for _ in range(8)),
+        "ip": ":".join("{:x}".format(rng.randint(0, 65535))
+                       for _ in range(8)),
+        "last_login": "2019-11-14 06:{:02d}:{:02d}".format(
+            rng.randint(0, 59), rng.randint(0, 59)),
+        "user_agent": "Mozilla/5.0 (X11; Linux x86_64)",
+    }
+    used = sum(len(k) + len(v) + 2 for k, v in row.items())
+    row["user_agent"] += " x" * max(0, (length - used) // 2)
+    return row
+
+
+def make_case(fields: int, length: int, separator: str, match_rate: float,
+              rng: random.Random) -> Dict:
+    """
+    Build the inputs of one benchmark case: the list of fields to redact
+    (PII_FIELDS plus synthetic ones up to `fields`) and ROWS messages where
+    about `match_rate` of those fields are present.
+    """
+    names = list(PII_FIELDS) + ["field_{}".format(i)
+                                for i in range(fields - len(PII_FIELDS))]
+    messages = []
+    for _ in range(ROWS):
+        row = synthetic_row(rng, length)
+        for name in names:
+            if name not in row and rng.random() < match_rate:
+                row[name] = "v{}".format(rng.randint(0, 9999))
+        for i, name in enumerate(PII_FIELDS):
+            if rng.random() >= match_rate:
+                row["c{}".format(i)] = row.pop(name)
+        messages.append("".join("{}={}{}".format(k, v, separator)
+                                for k, v in row.items()))
+    return {"fields": names, "separator": separator, "messages": messages}
+
+
+def bench_filter_datum(case: Dict) -> None:
+    """ Run filter_datum once over every message of the case """
+    fields, separator = case["fields"], case["separator"]
+    for message in case["messages"]:
+        filter_datum(fields, "***", message, separator)
+
+
+def bench_filter_datum_scanner(case: Dict) -> None:
+    """ Run filter_datum with the scanner backend over every message """
+    fields, separator = case["fields"], case["separator"]
+    for message in case["messages"]:
+        filter_datum(fields, "***", message, separator, "scanner")
+
+
+def bench_formatter(case: Dict) -> None:
+    """ Run RedactingFormatter.format once over every record of the case """
+    formatter, records = case["formatter"], case["records"]
+    for record in records:
+        formatter.format(record)
+
+
+def bench_formatter_scanner(case: Dict) -> None:
+    """ Run the scanner-backed RedactingFormatter over every record """
+    formatter, records = case["scanner_formatter"], case["records"]
+    for record in records:
+        formatter.format(record)
+
+
+TARGETS = {
+    "filter_datum": bench_filter_datum,
+    "filter_datum_scanner": bench_filter_datum_scanner,
+    "formatter": bench_formatter,
+    "formatter_scanner": bench_formatter_scanner,
+}
+
+
+def prepare_formatter(case: Dict) -> None:
+    """ Add a formatter and pre-built log records to the case """
+    formatter_class = type("RedactingFormatter", (RedactingFormatter,),
+                           {"SEPARATOR": case["separator"]})
+    case["formatter"] = formatter_class(case["fields"])
+    case["scanner_formatter"] = formatter_class(case["fields"],
+                                                backend="scanner")
+    case["records"] = [
+        logging.LogRecord("user_data", logging.INFO, None, None, m, None, None)
+        for m in case["messages"]]
+
+
+def measure(func, case: Dict, repeat: int = REPEAT) -> Dict[str, float]:
+    """
+    Time `func(case)` `repeat` times and report the median nanoseconds per
+    message, then trace one extra run to report allocations per message.
+    """
+    func(case)
+    rows = len(case["messages"])
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        func(case)
+        timings.append((time.perf_counter_ns() - start) / rows)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    func(case)
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    blocks = sum(max(s.count_diff, 0) for s in stats)
+    return {
+        "ns_per_op": statistics.median(timings),
+        "min_ns_per_op": min(timings),
+        "peak_bytes": peak,
+        "retained_blocks_per_op": blocks / rows,
+    }
+
+
+def run(field_counts: Sequence[int] = FIELD_COUNTS,
+        lengths: Sequence[int] = MESSAGE_LENGTHS,
+        separators: Sequence[str] = SEPARATORS,
+        match_rates: Sequence[float] = MATCH_RATES,
+        targets: Sequence[str] = tuple(TARGETS),
+        repeat: int = REPEAT) -> Dict[str, Dict[str, float]]:
+    """
+    Run every combination of the parameters and return the results keyed
+    by a readable case name.
+    """
+    results = {}
+    grid = itertools.product(field_counts, lengths, separators, match_rates)
+    for fields, length, separator, rate in grid:
+        rng = random.Random("{}-{}-{}-{}".format(SEED, fields, length, rate))
+        case = make_case(fields, length, separator, rate, rng)
+        prepare_formatter(case)
+        for target in targets:
+            name = "{} fields={} len={} sep={} match={}".format(
+                target, fields, length, separator, rate)
+            results[name] = measure(TARGETS[target], case, repeat)
+    return results
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    Return the cases whose median ns/op grew by more than `threshold`
+    (0.2 = 20%) over the baseline.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = result["ns_per_op"] / base["ns_per_op"]
+        if ratio > 1 + threshold:
+            regressions.append("{}: {:.0f} -> {:.0f} ns/op (+{:.0%})".format(
+                name, base["ns_per_op"], result["ns_per_op"], ratio - 1))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Command line entry point; prints one line per case and returns 1 when a
+    regression over the compared baseline is found.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[2])
+    parser.add_argument("--quick", action="store_true",
+                        help="only run the smallest grid")
+    parser.add_argument("--target", choices=tuple(TARGETS), action="append",
+                        help="benchmark only this function")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--save", help="write the results to this file")
+    parser.add_argument("--compare", help="baseline file to compare to")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    grid = {}
+    if args.quick:
+        grid = {"field_counts": FIELD_COUNTS[:1], "lengths": (128,),
+                "separators": (";",), "match_rates": (1.0,)}
+    results = run(targets=args.target or tuple(TARGETS), repeat=args.repeat,
+                  **grid)
+    for name, result in results.items():
+        print("{:<63} {:>10.0f} ns/op {:>9} peak B {:>6.2f} blocks/op".format(
+            name, result["ns_per_op"], result["peak_bytes"],
+            result["retained_blocks_per_op"]))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print("REGRESSION " + line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,8 +2,25 @@
 """
 Encrypt Passwords
 """
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import (Future, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
 import bcrypt
 
+HASH_WORKERS = os.cpu_count() or 1
+DEFAULT_ROUNDS = 12
+MIN_ROUNDS = 4
+MAX_ROUNDS = 16
+TARGET_HASH_MS = 250.0
+BATCH_CHUNK_SIZE = 64
+
 
 def hash_password(password: str) -> bytes:
     """
@@ -12,7 +29,8 @@ def hash_password(password: str) -> bytes:
     password and returns a salted, hashed password, which is a byte string.
     Use the bcrypt package to perform the hashing (with hashpw).
     """
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    salt = bcrypt.gensalt(bcrypt_rounds())
+    return bcrypt.hashpw(password.encode('utf-8'), salt)
 
 
 def is_valid(hashed_password: bytes, password: str) -> bool:
@@ -26,3 +44,212 @@ def is_valid(hashed_password: bytes, password: str) -> bool:
     password.
     """
     return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+
+
+_rounds = None
+
+
+def bcrypt_rounds() -> int:
+    """
+    Return the bcrypt cost factor used by hash_password: the BCRYPT_ROUNDS
+    environment variable if set, else the value chosen by the last
+    calibrate_rounds call, else DEFAULT_ROUNDS (bcrypt's own default).
+    """
+    env = os.environ.get("BCRYPT_ROUNDS")
+    if env:
+        return int(env)
+    return _rounds if _rounds is not None else DEFAULT_ROUNDS
+
+
+def calibrate_rounds(target_ms: float = TARGET_HASH_MS,
+                     min_rounds: int = MIN_ROUNDS,
+                     max_rounds: int = MAX_ROUNDS) -> int:
+    """
+    Pick the highest cost factor whose hashing time on this machine stays
+    within target_ms, cache it for bcrypt_rounds() and return it.
+    * Each extra round doubles the work, so one hash at min_rounds predicts
+    the others; the prediction is then checked with one real hash and the
+    cost lowered while it is over the target.
+    """
+    global _rounds
+
+    def elapsed_ms(rounds: int) -> float:
+        """ Time one hash at `rounds` """
+        start = time.perf_counter()
+        bcrypt.hashpw(b"calibration", bcrypt.gensalt(rounds))
+        return (time.perf_counter() - start) * 1000
+
+    base = elapsed_ms(min_rounds)
+    rounds = min_rounds
+    while rounds < max_rounds and base * 2 ** (rounds + 1 - min_rounds) \
+            <= target_ms:
+        rounds += 1
+    while rounds > min_rounds and elapsed_ms(rounds) > target_ms:
+        rounds -= 1
+    _rounds = rounds
+    return rounds
+
+
+def hash_rounds(hashed_password: bytes) -> int:
+    """ Return the cost factor stored in a bcrypt hash ($2b$<cost>$...) """
+    return int(hashed_password.split(b"$")[2])
+
+
+def needs_rehash(hashed_password: bytes, downgrade: bool = False) -> bool:
+    """
+    Tell whether a stored hash was made with a lower cost factor than the
+    current bcrypt_rounds(). A higher cost only counts with downgrade=True,
+    so that processes calibrated differently never rewrite each other's
+    hashes and a slow calibration never weakens stored ones.
+    """
+    rounds = hash_rounds(hashed_password)
+    if downgrade:
+        return rounds != bcrypt_rounds()
+    return rounds < bcrypt_rounds()
+
+
+def verify_and_update(hashed_password: bytes, password: str,
+                      downgrade: bool = False) -> Tuple[bool, Optional[bytes]]:
+    """
+    Check `password` against `hashed_password`. Returns (valid, new_hash)
+    where new_hash is a fresh hash at the current cost when the password is
+    valid but needs_rehash(hashed_password, downgrade), None otherwise.
+    """
+    if not is_valid(hashed_password, password):
+        return False, None
+    if needs_rehash(hashed_password, downgrade):
+        return True, hash_password(password)
+    return True, None
+
+
+class HashingExecutor:
+    """
+    Bounded pool of threads running hash_password and is_valid. bcrypt
+    releases the GIL while hashing, so up to max_workers hashes run in
+    parallel on as many cores while the callers only wait on futures.
+    """
+
+    def __init__(self, max_workers: int = HASH_WORKERS):
+        """ Init """
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers,
+                                        thread_name_prefix="bcrypt")
+
+    def submit_hash(self, password: str) -> Future:
+        """ Schedule hash_password(password) and return its future """
+        return self._pool.submit(hash_password, password)
+
+    def submit_is_valid(self, hashed_password: bytes,
+                        password: str) -> Future:
+        """ Schedule is_valid(hashed_password, password) """
+        return self._pool.submit(is_valid, hashed_password, password)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """ Stop the worker threads once the queued work is done """
+        self._pool.shutdown(wait=wait)
+
+    def __enter__(self) -> "HashingExecutor":
+        """ Enter """
+        return self
+
+    def __exit__(self, *exc) -> None:
+        """ Exit """
+        self.shutdown()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_hashing_executor() -> HashingExecutor:
+    """
+    Return the process-wide HashingExecutor used by the async functions,
+    created with HASH_WORKERS threads on first use.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = HashingExecutor()
+        return _executor
+
+
+async def hash_password_async(password: str,
+                              executor: Optional[HashingExecutor] = None
+                              ) -> bytes:
+    """
+    Coroutine version of hash_password: the hash runs on `executor` (the
+    shared one by default) and the event loop stays free meanwhile.
+    """
+    executor = executor or get_hashing_executor()
+    return await asyncio.wrap_future(executor.submit_hash(password))
+
+
+async def is_valid_async(hashed_password: bytes, password: str,
+                         executor: Optional[HashingExecutor] = None) -> bool:
+    """
+    Coroutine version of is_valid, running the check on `executor` (the
+    shared one by default).
+    """
+    executor = executor or get_hashing_executor()
+    future = executor.submit_is_valid(hashed_password, password)
+    return await asyncio.wrap_future(future)
+
+
+def hash_passwords(passwords: Iterable[str],
+                   chunk_size: int = BATCH_CHUNK_SIZE,
+                   workers: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Hash every password of `passwords` with hash_password semantics and
+    yield the hashes in input order, as they are ready.
+    * The input is consumed lazily, chunk_size passwords at a time, and
+    the chunks are hashed by a pool of `workers` processes (one per core by
+    default) with at most two chunks per worker in flight, so memory stays
+    flat whatever the number of passwords.
+    """
+    rounds = bcrypt_rounds()
+    return _run_chunks(_hash_chunk, ((p, rounds) for p in passwords),
+                       chunk_size, workers)
+
+
+def verify_many(pairs: Iterable[Tuple[bytes, str]],
+                chunk_size: int = BATCH_CHUNK_SIZE,
+                workers: Optional[int] = None) -> Iterator[bool]:
+    """
+    Check every (hashed_password, password) pair of `pairs` like is_valid
+    and yield the results in input order; the work is spread like in
+    hash_passwords.
+    """
+    return _run_chunks(_verify_chunk, pairs, chunk_size, workers)
+
+
+def _hash_chunk(items: List[Tuple[str, int]]) -> List[bytes]:
+    """ Hash a chunk of (password, rounds) in a worker process """
+    return [bcrypt.hashpw(p.encode('utf-8'), bcrypt.gensalt(r))
+            for p, r in items]
+
+
+def _verify_chunk(pairs: List[Tuple[bytes, str]]) -> List[bool]:
+    """ Check a chunk of (hashed_password, password) in a worker process """
+    return [is_valid(h, p) for h, p in pairs]
+
+
+def _run_chunks(func: Callable, items: Iterable, chunk_size: int,
+                workers: Optional[int]) -> Iterator:
+    """
+    Feed `items` to `func` in chunks on a process pool and yield the
+    results of every chunk, in order, keeping a bounded number of chunks
+    in flight.
+    """
+    workers = workers or HASH_WORKERS
+    items = iter(items)
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            while len(pending) < 2 * workers:
+                chunk = list(islice(items, chunk_size))
+                if not chunk:
+                    break
+                pending.append(pool.submit(func, chunk))
+            if not pending:
+                return
+            yield from pending.popleft().result()
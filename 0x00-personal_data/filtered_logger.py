@@ -3,12 +3,42 @@
 filtered_logger.py
 """
 import re
-from typing import List
+import argparse
+import atexit
+import copy
+import csv
+import mmap
+import queue
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter, deque
+from collections.abc import Mapping
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+from typing import (Any, Callable, Iterable, Iterator, List, Optional,
+                    Pattern, Sequence, Tuple, Union)
 import logging
+import logging.handlers
 import os
 import mysql.connector
 
 PII_FIELDS = ("name", "email", "phone", "ssn", "password")
+USER_COLUMNS = ("name", "email", "phone", "ssn", "password", "ip",
+                "last_login", "user_agent")
+PATTERN_CACHE_SIZE = 128
+CSV_ENCODING = "utf-8"
+LOG_QUEUE_SIZE = 10000
+OVERFLOW_POLICIES = ("block", "drop", "count")
+DB_POOL_SIZE = 4
+DB_BATCH_SIZE = 1000
+STATS_SAMPLES = 10000
+STATS_PERCENTILES = (50, 90, 99)
+BACKENDS = ("regex", "scanner")
+EXPORT_PARTITIONS = 4
 
 
 class RedactingFormatter(logging.Formatter):
@@ -24,18 +54,170 @@ class RedactingFormatter(logging.Formatter):
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
 
-    def __init__(self, fields: List[str]):
+    def __init__(self, fields: List[str],
+                 stats: Optional["RedactionStats"] = None,
+                 backend: str = "regex"):
         """ Init """
+        if backend not in BACKENDS:
+            raise ValueError("backend must be one of {}".format(
+                ", ".join(BACKENDS)))
         self.fields = fields
+        self.stats = stats
+        self.backend = backend
+        self._pattern = _redaction_pattern(tuple(fields), self.SEPARATOR)
+        self._replacement = _redaction_template(self.REDACTION, self.SEPARATOR)
+        self._scanner = None
+        if backend == "scanner":
+            self._scanner = _key_scanner(tuple(fields))
         super(RedactingFormatter, self).__init__(self.FORMAT)
 
     def format(self, record: logging.LogRecord) -> str:
         """ Format """
-        return filter_datum(self.fields, self.REDACTION,
-                            super().format(record), self.SEPARATOR)
+        if self.stats is None and self._scanner is None:
+            return self._pattern.sub(self._replacement, super().format(record))
+        return self._counted_sub(super().format(record))
 
+    def _counted_sub(self, message: str) -> str:
+        """
+        Redact `message` with the configured backend, feeding the time and
+        fields to self.stats when there is one.
+        """
+        if self.stats is None:
+            return self._scanner.redact(message, self.REDACTION,
+                                        self.SEPARATOR)
+        found = []
+        if self._scanner is not None:
+            start = time.perf_counter_ns()
+            result = self._scanner.redact(message, self.REDACTION,
+                                          self.SEPARATOR, found)
+            self.stats.record(time.perf_counter_ns() - start, found,
+                              _size(message), _size(result))
+            return result
+        replacement = self._replacement
 
-def filter_datum(fields: List[str], redaction: str, message: str, separator: str) -> str:  # noqa
+        def replace(match):
+            """ Remember the field of the match, then redact it """
+            found.append(match["field"])
+            if callable(replacement):
+                return replacement(match)
+            return match.expand(replacement)
+
+        start = time.perf_counter_ns()
+        result = self._pattern.sub(replace, message)
+        self.stats.record(time.perf_counter_ns() - start, found,
+                          _size(message), _size(result))
+        return result
+
+
+class StructuredRedactingFormatter(RedactingFormatter):
+    """
+    RedactingFormatter for structured records: when the log message is a
+    dict it is redacted by key, when it is a tuple or a list (a DB row) it is
+    redacted by position using `columns` as the schema. The record is then
+    rendered once as `key=value;` pairs, without any regex. Any other
+    message (str, bytes, numbers, exceptions...) still goes through the
+    RedactingFormatter path.
+    """
+
+    def __init__(self, fields: List[str],
+                 columns: Sequence[str] = USER_COLUMNS,
+                 stats: Optional["RedactionStats"] = None,
+                 backend: str = "regex"):
+        """ Init """
+        super().__init__(fields, stats, backend)
+        self.columns = tuple(columns)
+        self._keys = frozenset(fields)
+        self._hidden = tuple(c in self._keys for c in self.columns)
+
+    def redact(self, data: Any, hide: bool = True) -> str:
+        """
+        Render a dict or a row as a redacted `key=value;` line (as is with
+        hide=False)
+        """
+        if isinstance(data, Mapping):
+            pairs = [(k, self.REDACTION if hide and k in self._keys else v)
+                     for k, v in data.items()]
+        else:
+            pairs = [(c, self.REDACTION if hide and hidden else v)
+                     for c, hidden, v in zip(self.columns, self._hidden, data)]
+        return " ".join("{}={}{}".format(k, v, self.SEPARATOR)
+                        for k, v in pairs)
+
+    def format(self, record: logging.LogRecord) -> str:
+        """ Format """
+        if not isinstance(record.msg, (Mapping, tuple, list)):
+            return super().format(record)
+        msg, args = record.msg, record.args
+        start = time.perf_counter_ns()
+        record.msg, record.args = self.redact(msg), None
+        if self.stats is not None:
+            elapsed = time.perf_counter_ns() - start
+            if isinstance(msg, Mapping):
+                found = [k for k in msg if k in self._keys]
+            else:
+                found = [c for c, hidden in zip(self.columns[:len(msg)],
+                                                self._hidden) if hidden]
+            self.stats.record(elapsed, found,
+                              _size(self.redact(msg, hide=False)),
+                              _size(record.msg))
+        try:
+            return logging.Formatter.format(self, record)
+        finally:
+            record.msg, record.args = msg, args
+
+
+class RedactionStats:
+    """
+    Thread-safe counters of the redaction work done by the formatters that
+    share this object: records formatted, redactions per field name, time
+    spent redacting (total and percentiles over the last `samples` records)
+    and message sizes in UTF-8 bytes before and after redaction.
+    """
+
+    def __init__(self, samples: int = STATS_SAMPLES):
+        """ Init """
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=samples)
+        self.records = 0
+        self.fields = Counter()
+        self.redact_ns = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def record(self, elapsed_ns: int, fields: Iterable[str],
+               bytes_in: int, bytes_out: int) -> None:
+        """ Account for one formatted record """
+        with self._lock:
+            self.records += 1
+            self.fields.update(fields)
+            self.redact_ns += elapsed_ns
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self._samples.append(elapsed_ns)
+
+    def snapshot(self) -> dict:
+        """ Return a consistent copy of the counters as a dictionary """
+        with self._lock:
+            samples = sorted(self._samples)
+            result = {
+                "records": self.records,
+                "fields": dict(self.fields),
+                "redact_ns": self.redact_ns,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+            }
+        for p in STATS_PERCENTILES:
+            rank = max(0, -(-len(samples) * p // 100) - 1)
+            result["p{}_ns".format(p)] = samples[rank] if samples else 0
+        return result
+
+
+def _size(message: str) -> int:
+    """ Size in bytes of `message` encoded as UTF-8 """
+    return len(message.encode(CSV_ENCODING, "surrogatepass"))
+
+
+def filter_datum(fields: List[str], redaction: str, message: str, separator: str, backend: str = "regex") -> str:  # noqa
     """
     a function called filter_datum that returns the log message obfuscated:
     * Arguments:
@@ -48,14 +230,156 @@ def filter_datum(fields: List[str], redaction: str, message: str, separator: str
     values.
     * filter_datum should be less than 5 lines long and use re.sub to perform
     the substitution with a single regex.
+    * backend="scanner" uses KeyScanner instead (fields and redaction are
+    then taken literally), which also accepts bytes messages.
+    """
+    if backend == "scanner":
+        return _key_scanner(tuple(fields)).redact(message, redaction,
+                                                  separator)
+    pattern = _redaction_pattern(tuple(fields), separator)
+    return pattern.sub(_redaction_template(redaction, separator), message)
+
+
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def _redaction_pattern(fields: Tuple[str, ...], separator: str) -> Pattern:
+    """
+    Compile a single alternation regex matching `field=value<separator>` for
+    every field, so that a message is redacted in one scan. Patterns are
+    cached per (fields, separator) pair; fields keep their order so the
+    alternation prefers them the same way the per-field loop did.
+    """
+    if not fields:
+        return re.compile(r"(?P<field>(?!))")
+    alternation = "|".join("(?:{})".format(f) for f in fields)
+    return re.compile(
+        rf"(?P<field>{alternation})=(?P<value>.*?)\{separator}")
+
+
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def _bytes_redaction_pattern(fields: Tuple[str, ...],
+                             separator: str) -> Pattern:
     """
-    for f in fields:
-        message = re.sub(rf"{f}=(.*?)\{separator}",
-                         f'{f}={redaction}{separator}', message)
-    return message
+    Same pattern as _redaction_pattern, compiled for bytes-like subjects
+    such as mmap objects.
+    """
+    pattern = _redaction_pattern(fields, separator).pattern
+    return re.compile(pattern.encode(CSV_ENCODING))
 
 
-def get_logger() -> logging.Logger:
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def _redaction_template(redaction: str,
+                        separator: str) -> Union[str, Callable]:
+    """
+    Build the re.sub replacement writing back the matched field name
+    followed by the redaction and the separator. Without backslashes there
+    is nothing to expand, so a plain function is returned: it is about twice
+    as fast as letting re expand a template for every match.
+    """
+    if "\\" in redaction + separator:
+        return r"\g<field>=" + redaction + separator
+    tail = "=" + redaction + separator
+    return lambda match: match[1] + tail
+
+
+class KeyScanner:
+    """
+    Multi-key scanner finding every `key=value<separator>` span of a str or
+    bytes-like message (bytes, bytearray, mmap) in one pass.
+    * The message is scanned for "=" with the C-level find. At each "=" whose
+    previous character ends some key, the keys that could end there are
+    looked up in a hash table, longest first, which yields the same matches
+    as an Aho-Corasick automaton over all `key=` patterns. The Python work
+    is proportional to the number of "=" times the number of distinct key
+    lengths, whatever the number of keys or the message length.
+    * Matches follow the filter_datum regex semantics: leftmost first, not
+    overlapping, and a value never spans a newline. Keys are literal
+    strings and must not contain "=".
+    """
+
+    def __init__(self, keys: Sequence[str]):
+        """ Init """
+        self.keys = tuple(keys)
+        self._tables = {
+            str: self._build(self.keys),
+            bytes: self._build(k.encode(CSV_ENCODING) for k in self.keys),
+        }
+        self._lengths = sorted({len(k) for k in self.keys if k},
+                               reverse=True)
+        self._last = {
+            str: frozenset(k[-1:] for k in self._tables[str]),
+            bytes: frozenset(k[-1:] for k in self._tables[bytes]),
+        }
+
+    @staticmethod
+    def _build(keys: Iterable[Any]) -> dict:
+        """ Map every key (str or bytes) to the index of its first use """
+        table = {}
+        for i, key in enumerate(keys):
+            table.setdefault(key, i)
+        return table
+
+    def redact(self, data: Any, redaction: str, separator: str,
+               found: Optional[List[str]] = None) -> Any:
+        """
+        Return `data` (str or bytes) with every matched value replaced by
+        `redaction`; the matched keys are appended to `found` if given.
+        """
+        if isinstance(data, str):
+            kind, eq, newline = str, "=", "\n"
+        else:
+            kind, eq, newline = bytes, b"=", b"\n"
+            separator = separator.encode(CSV_ENCODING)
+            redaction = redaction.encode(CSV_ENCODING)
+        table, last = self._tables[kind], self._last[kind]
+        find, lengths = data.find, self._lengths
+        pieces, cursor, resume, line_end = [], 0, 0, -1
+        pos = find(eq)
+        while pos != -1:
+            next_pos = pos + 1
+            if data[pos - 1:pos] not in last:
+                pos = find(eq, next_pos)
+                continue
+            for size in lengths:
+                start = pos - size
+                if start < resume:
+                    continue
+                key = table.get(data[start:pos])
+                if key is None:
+                    continue
+                end = find(separator, pos + 1)
+                if end == -1:
+                    next_pos = -1
+                    break
+                if line_end <= pos:
+                    line_end = find(newline, pos + 1)
+                    if line_end == -1:
+                        line_end = len(data)
+                if line_end < end:
+                    continue
+                pieces.append(data[cursor:pos + 1])
+                pieces.append(redaction)
+                cursor, resume = end, end + len(separator)
+                next_pos = resume
+                if found is not None:
+                    found.append(self.keys[key])
+                break
+            if next_pos == -1:
+                break
+            pos = find(eq, next_pos)
+        if not pieces:
+            return data
+        pieces.append(data[cursor:])
+        return redaction[:0].join(pieces)
+
+
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def _key_scanner(fields: Tuple[str, ...]) -> KeyScanner:
+    """ Return the cached KeyScanner of `fields` """
+    return KeyScanner(fields)
+
+
+def get_logger(non_blocking: bool = False, queue_size: int = LOG_QUEUE_SIZE,
+               overflow: str = "block") -> logging.Logger:
     """
     * Use user_data.csv for this task
     * Implement a get_logger function that takes no arguments and returns a
@@ -68,16 +392,102 @@ def get_logger() -> logging.Logger:
     contain only 5 fields - choose the right list of fields that can are
     considered as “important” PIIs or information that you must hide in your
     logs. Use it to parameterize the formatter.
+    * With non_blocking=True the logger gets a RedactingQueueHandler instead:
+    records go through a queue of queue_size entries and are redacted and
+    written by a background QueueListener. overflow picks what happens when
+    the queue is full (see RedactingQueueHandler).
     """
     logger = logging.getLogger("user_data")
     logger.setLevel(logging.INFO)
     logger.propagate = False
     handler = logging.StreamHandler()
     handler.setFormatter(RedactingFormatter(PII_FIELDS))
+    if non_blocking:
+        handler = RedactingQueueHandler(handler, queue_size, overflow)
     logger.addHandler(handler)
     return logger
 
 
+class RedactingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler feeding a QueueListener that owns the real (redacting)
+    handler, so that redaction and stream I/O happen off the calling thread.
+    * queue_size bounds the queue (0 means unbounded).
+    * overflow is the policy for a full queue:
+        - "block": wait for the listener to make room
+        - "drop": discard the record
+        - "count": discard the record and increment self.dropped
+    * The listener is started right away and stopped (flushing every queued
+    record) by close(), which logging.shutdown calls at exit.
+    * Records are queued unformatted, so that formatting and redaction
+    (including StructuredRedactingFormatter on dict and row messages) run
+    on the listener thread only.
+    """
+
+    def __init__(self, handler: logging.Handler,
+                 queue_size: int = LOG_QUEUE_SIZE, overflow: str = "block"):
+        """ Init """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("overflow must be one of {}".format(
+                ", ".join(OVERFLOW_POLICIES)))
+        super().__init__(queue.Queue(queue_size))
+        self.overflow = overflow
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self.listener = _BlockingQueueListener(
+            self.queue, handler, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Return a copy of the record with its msg and args untouched, only
+        rendering the traceback now (it may not survive the calling frame)
+        """
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = _TRACEBACK_FORMATTER.formatException(
+                record.exc_info)
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """ Put the record on the queue following the overflow policy """
+        if self.overflow == "block":
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if self.overflow == "count":
+                with self._dropped_lock:
+                    self.dropped += 1
+
+    def close(self) -> None:
+        """ Drain the queue, stop the listener and close its handlers """
+        if self.listener is not None:
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.flush()
+                handler.close()
+            self.listener = None
+        super().close()
+
+
+class _BlockingQueueListener(logging.handlers.QueueListener):
+    """
+    QueueListener whose stop marker waits for room in a full bounded queue
+    (the stock one uses put_nowait and raises queue.Full, leaving the
+    listener running and the queued records unwritten).
+    """
+
+    def enqueue_sentinel(self) -> None:
+        """ Queue the stop marker behind the pending records """
+        self.queue.put(self._sentinel)
+
+
+_TRACEBACK_FORMATTER = logging.Formatter()
+
+
 def get_db() -> mysql.connector.connection.MySQLConnection:
     """
     * In this task, you will connect to a secure holberton database to read a
@@ -104,6 +514,127 @@ def get_db() -> mysql.connector.connection.MySQLConnection:
     return conn
 
 
+class ConnectionPool:
+    """
+    Fixed-size pool of DB-API connections created on demand by `connect`
+    (get_db by default, or any factory such as a sqlite3 one for offline
+    runs). acquire() hands out an idle connection, opens a new one while the
+    pool is below `size`, and otherwise waits for a release().
+    """
+
+    def __init__(self, connect: Callable[[], Any] = get_db,
+                 size: int = DB_POOL_SIZE):
+        """ Init """
+        self.connect = connect
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: Optional[float] = None) -> Any:
+        """ Return an idle connection, opening one if the pool has room """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+        if not can_open:
+            return self._idle.get(timeout=timeout)
+        try:
+            return self.connect()
+        except Exception:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def release(self, conn: Any) -> None:
+        """ Give a connection back to the pool """
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None) -> Iterator[Any]:
+        """ Context manager acquiring and releasing a connection """
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self) -> None:
+        """ Close every idle connection """
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+
+@lru_cache(maxsize=None)
+def get_db_pool(size: int = DB_POOL_SIZE) -> ConnectionPool:
+    """
+    Return the process-wide pool of get_db connections, created on first
+    use.
+    """
+    return ConnectionPool(get_db, size)
+
+
+class ReadStats:
+    """
+    Progress of a stream_rows read: rows fetched so far, seconds elapsed
+    since the query was executed and the resulting throughput.
+    """
+
+    def __init__(self):
+        """ Init """
+        self.rows = 0
+        self.batches = 0
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        """ Average number of rows read per second """
+        if self.elapsed <= 0:
+            return 0.0
+        return self.rows / self.elapsed
+
+
+def stream_rows(conn: Any, query: str, params: Sequence = (),
+                batch_size: int = DB_BATCH_SIZE,
+                stats: Optional[ReadStats] = None) -> Iterator[tuple]:
+    """
+    Execute `query` on `conn` and yield its rows, fetched `batch_size` at a
+    time with cursor.fetchmany so only one batch is held in memory (the
+    default mysql-connector cursor is unbuffered, so rows stay on the
+    server until fetched). Pass a ReadStats to follow the throughput.
+    """
+    if stats is None:
+        stats = ReadStats()
+    cursor = conn.cursor()
+    try:
+        stats.started = time.monotonic()
+        if params:
+            cursor.execute(query, params)
+        else:
+            cursor.execute(query)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            stats.batches += 1
+            stats.rows += len(rows)
+            stats.elapsed = time.monotonic() - stats.started
+            yield from rows
+    finally:
+        cursor.close()
+
+
 def main() -> None:
     """
     * Implement a main function that takes no arguments and returns nothing.
@@ -116,18 +647,294 @@ def main() -> None:
         - ssn
         - password
     * Only your main function should run when the module is executed.
+    * The connection comes from get_db_pool(), and the read throughput is
+    reported on stderr once every row is displayed.
+    """
+    pool = get_db_pool()
+    stats = ReadStats()
+    try:
+        with pool.connection() as db:
+            for row in stream_rows(db, "SELECT * FROM users;", stats=stats):
+                message = f"name={row[0]}; email={row[1]}; " +\
+                    f"phone={row[2]}; ssn={row[3]}; password={row[4]};" +\
+                    f"ip={row[5]}; last_login={row[6]}; " +\
+                    f"user_agent={row[7]};"
+                print(message)
+    finally:
+        pool.close()
+    print("{} rows in {:.3f}s ({:.0f} rows/s)".format(
+        stats.rows, stats.elapsed, stats.rows_per_second), file=sys.stderr)
+
+
+def redact_csv(src: str, dst: str, fields: Sequence[str] = PII_FIELDS,
+               redaction: str = RedactingFormatter.REDACTION,
+               workers: int = 1) -> int:
+    """
+    Stream the CSV file `src` row by row and write a copy to `dst` where the
+    columns named in `fields` are replaced by `redaction`.
+    * The first row is the header (as in user_data.csv) and is copied as is.
+    * With workers > 1 the body is split into byte ranges that are redacted
+    by a process pool into `dst.partN` files (truncated first, removed at
+    the end even on failure) and concatenated back in order. This assumes
+    one record per line (no quoted newlines), which holds for our exports.
+    * Returns the number of data rows written.
+    """
+    with open(src, 'rb') as f:
+        header_line = f.readline()
+        body_start = f.tell()
+        size = f.seek(0, os.SEEK_END)
+    if not header_line:
+        open(dst, 'wb').close()
+        return 0
+    header = next(csv.reader([header_line.decode(CSV_ENCODING)]))
+    columns = tuple(i for i, name in enumerate(header) if name in fields)
+
+    with open(dst, 'wb') as out:
+        out.write(header_line)
+    if workers <= 1 or size - body_start <= workers:
+        ranges = [(body_start, size)]
+    else:
+        step = (size - body_start) // workers
+        bounds = [body_start + i * step for i in range(workers)] + [size]
+        ranges = list(zip(bounds[:-1], bounds[1:]))
+    if len(ranges) == 1:
+        return _redact_csv_range(src, dst, ranges[0], columns, redaction)
+
+    parts = ["{}.part{}".format(dst, i) for i in range(len(ranges))]
+    try:
+        for part in parts:
+            open(part, 'wb').close()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            counts = list(pool.map(_redact_csv_range, [src] * len(ranges),
+                                   parts, ranges, [columns] * len(ranges),
+                                   [redaction] * len(ranges)))
+        with open(dst, 'ab') as out:
+            for part in parts:
+                with open(part, 'rb') as f:
+                    shutil.copyfileobj(f, out)
+    finally:
+        for part in parts:
+            if os.path.exists(part):
+                os.remove(part)
+    return sum(counts)
+
+
+def _redact_csv_range(src: str, dst: str, byte_range: Tuple[int, int],
+                      columns: Tuple[int, ...], redaction: str) -> int:
+    """
+    Redact the CSV lines of `src` starting inside `byte_range` and append
+    them to `dst`. A line belongs to the range its first byte falls in, so
+    adjacent ranges never share or lose a line.
+    """
+    start, end = byte_range
+    count = 0
+    with open(src, 'rb') as f, \
+            open(dst, 'a', encoding=CSV_ENCODING, newline='') as out:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+        writer = csv.writer(out, lineterminator='\n')
+        for row in csv.reader(_lines_until(f, end)):
+            for i in columns:
+                if i < len(row):
+                    row[i] = redaction
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def _lines_until(f, end: int) -> Iterable[str]:
+    """
+    Yield decoded lines from the binary file `f` while they start before the
+    byte offset `end`.
+    """
+    while f.tell() < end:
+        line = f.readline()
+        if not line:
+            break
+        yield line.decode(CSV_ENCODING)
+
+
+def redact_file(path: str, fields: Sequence[str] = PII_FIELDS,
+                redaction: str = RedactingFormatter.REDACTION,
+                separator: str = RedactingFormatter.SEPARATOR,
+                output: Optional[str] = None, pad: bytes = b" ") -> int:
+    """
+    Redact the `field=value<separator>` spans of a log file with the
+    filter_datum rules, through mmap and without decoding the file.
+    * Every value is overwritten in place by `redaction` padded with `pad`
+    up to the value length, so the file keeps its size and offsets. A value
+    shorter than the redaction gets the first len(value) bytes of it.
+    * With `output`, the file is first copied there and the copy is
+    redacted, leaving `path` untouched.
+    * Returns the number of redacted spans.
+    """
+    if output is not None:
+        shutil.copyfile(path, output)
+        path = output
+    if os.path.getsize(path) == 0:
+        return 0
+    pattern = _bytes_redaction_pattern(tuple(fields), separator)
+    mask = redaction.encode(CSV_ENCODING)
+    count = 0
+    with open(path, 'r+b') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE) as mm:
+        for m in pattern.finditer(mm):
+            start, end = m.span("value")
+            size = end - start
+            mm[start:end] = (mask + pad * size)[:size]
+            count += 1
+        mm.flush()
+    return count
+
+
+def redact_csv_cli(argv: Optional[List[str]] = None) -> None:
+    """
+    Command line entry point for redact_csv:
+    ./filtered_logger.py SRC DST [--fields a,b] [--workers N]
+    """
+    parser = argparse.ArgumentParser(
+        description="Write a redacted copy of a CSV export")
+    parser.add_argument("src", help="CSV file to read, header first")
+    parser.add_argument("dst", help="path of the redacted copy")
+    parser.add_argument("--fields", default=",".join(PII_FIELDS),
+                        help="comma separated columns to redact")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes")
+    args = parser.parse_args(argv)
+    fields = tuple(f.strip() for f in args.fields.split(",") if f.strip())
+    redact_csv(args.src, args.dst, fields, workers=args.workers)
+
+
+def export_users(out_dir: str, partitions: int = EXPORT_PARTITIONS,
+                 key: str = "last_login", workers: Optional[int] = None,
+                 merge: Optional[str] = None,
+                 connect: Callable[[], Any] = get_db,
+                 placeholder: str = "%s") -> List[str]:
+    """
+    Export the users table redacted, one worker process per key range.
+    * The [MIN(key), MAX(key)] range of the users table is split in
+    `partitions` ranges (key is a numeric or timestamp column such as
+    last_login or a primary key); rows with a NULL key get a last partition.
+    The partition row counts must add up to COUNT(*) of the table, or a
+    RuntimeError is raised (before `merge` is written).
+    * Each range is read with its own `connect()` connection, ordered by
+    key, redacted with StructuredRedactingFormatter and written to
+    out_dir/users-NNNN.log. `connect` must be picklable (a module level
+    function) and `placeholder` is the paramstyle marker of its driver.
+    * With `merge`, the partitions are concatenated in order into that file;
+    since the ranges are disjoint and ascending the result is ordered by key.
+    * Returns the paths of the partition files.
+    """
+    if not key.isidentifier():
+        raise ValueError("Invalid key column: {}".format(key))
+    db = connect()
+    try:
+        lo, hi, total = next(stream_rows(
+            db, "SELECT MIN({0}), MAX({0}), COUNT(*) FROM users;".format(
+                key)))
+    finally:
+        db.close()
+
+    select = "SELECT {} FROM users WHERE ".format(", ".join(USER_COLUMNS))
+    queries = []
+    if lo is not None:
+        bounds = _split_range(lo, hi, partitions)
+        for i, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+            last = "<=" if i == len(bounds) - 2 else "<"
+            queries.append((
+                select + "{0} >= {1} AND {0} {2} {1} ORDER BY {0};".format(
+                    key, placeholder, last), (start, end)))
+    queries.append((select + "{} IS NULL;".format(key), ()))
+
+    os.makedirs(out_dir, exist_ok=True)
+    paths = [os.path.join(out_dir, "users-{:04d}.log".format(i))
+             for i in range(len(queries))]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        counts = list(pool.map(_export_partition, [connect] * len(queries),
+                               [q for q, _ in queries],
+                               [p for _, p in queries], paths))
+    if sum(counts) != total:
+        raise RuntimeError(
+            "Exported {} rows of {} in users: the {} ranges {} do not cover "
+            "the table".format(sum(counts), total, key, counts))
+    if merge is not None:
+        with open(merge, 'wb') as out:
+            for path in paths:
+                with open(path, 'rb') as f:
+                    shutil.copyfileobj(f, out)
+    return paths
+
+
+def _split_range(lo: Any, hi: Any, parts: int) -> List[Any]:
+    """
+    Return parts + 1 ascending bounds from lo to hi. Numbers and datetimes
+    are split evenly; timestamps read back as strings (sqlite) are parsed,
+    and the inner bounds are rendered back with the date/time separator of
+    lo so that they compare as strings like the column values do. The
+    outer bounds stay lo and hi as read.
+    """
+    text = (lo, hi) if isinstance(lo, str) else None
+    if text:
+        sep = lo[10] if len(lo) > 10 else "T"
+        lo, hi = datetime.fromisoformat(lo), datetime.fromisoformat(hi)
+    parts = max(1, parts)
+    step = (hi - lo) / parts
+    if isinstance(lo, int):
+        step = -(-(hi - lo) // parts) or 1
+    bounds = [lo + step * i for i in range(parts)]
+    bounds = sorted(set(b for b in bounds if b < hi)) or [lo]
+    bounds.append(hi)
+    if text:
+        return [text[0]] + [b.isoformat(sep) for b in bounds[1:-1]] + \
+            [text[1]]
+    return bounds
+
+
+def _export_partition(connect: Callable[[], Any], query: str,
+                      params: Sequence, path: str) -> int:
+    """
+    Stream the rows of one partition query into `path` as redacted lines
+    and return the number of rows written.
+    """
+    formatter = StructuredRedactingFormatter(PII_FIELDS)
+    db = connect()
+    count = 0
+    try:
+        with open(path, 'w', encoding=CSV_ENCODING) as out:
+            for row in stream_rows(db, query, params):
+                out.write(formatter.redact(row) + "\n")
+                count += 1
+    finally:
+        db.close()
+    return count
+
+
+def export_users_cli(argv: Optional[List[str]] = None) -> None:
+    """
+    Command line entry point for export_users:
+    ./filtered_logger.py export OUT_DIR [--partitions N] [--key COLUMN]
+    [--workers N] [--merge FILE]
     """
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("SELECT * FROM users;")
-    for row in cursor:
-        message = f"name={row[0]}; email={row[1]}; phone={row[2]}; " +\
-            f"ssn={row[3]}; password={row[4]};ip={row[5]}; " +\
-            f"last_login={row[6]}; user_agent={row[7]};"
-        print(message)
-    cursor.close()
-    db.close()
+    parser = argparse.ArgumentParser(
+        prog="filtered_logger.py export",
+        description="Export the users table redacted, in parallel")
+    parser.add_argument("out_dir", help="directory of the partition files")
+    parser.add_argument("--partitions", type=int, default=EXPORT_PARTITIONS)
+    parser.add_argument("--key", default="last_login",
+                        help="column the partitions are ranges of")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes")
+    parser.add_argument("--merge", help="also write all rows to this file")
+    args = parser.parse_args(argv)
+    export_users(args.out_dir, args.partitions, args.key, args.workers,
+                 args.merge)
 
 
 if __name__ == '__main__':
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == "export":
+        export_users_cli(sys.argv[2:])
+    elif len(sys.argv) > 1:
+        redact_csv_cli()
+    else:
+        main()
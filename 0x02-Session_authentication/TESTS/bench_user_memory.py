@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+""" Memory benchmark of the User store
+
+Builds --count users (1M by default) with realistic values and reports
+the memory traced per user for:
+- dict: the same attributes in a per-instance __dict__ (former layout)
+- slots: models.user.User instances
+- store: User instances saved in DATA with their indexes
+Run from the project root:
+    PYTHONPATH=. python3 TESTS/bench_user_memory.py --count 1000000
+"""
+import argparse
+import gc
+import hashlib
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+from models.base import DATA, INDEXES
+from models.user import User
+
+START = datetime(2024, 1, 1)
+
+
+class DictUser():
+    """ User attributes kept in a __dict__, as before __slots__
+    """
+
+    def __init__(self, **kwargs: dict):
+        """ Initialize a DictUser with the attributes of a User
+        """
+        self.id = kwargs['id']
+        self.created_at = kwargs['created_at']
+        self.updated_at = kwargs['updated_at']
+        self.email = kwargs['email']
+        self._password = kwargs['_password']
+        self.first_name = kwargs['first_name']
+        self.last_name = kwargs['last_name']
+
+
+def attributes(i: int) -> dict:
+    """ Attributes of the i-th synthetic user
+    """
+    return {
+        'id': str(uuid.UUID(int=i)),
+        'created_at': START + timedelta(seconds=i),
+        'updated_at': START + timedelta(seconds=2 * i),
+        'email': "user{}@example.com".format(i),
+        '_password': hashlib.sha256(str(i).encode()).hexdigest(),
+        'first_name': "First{}".format(i % 5000),
+        'last_name': "Last{}".format(i % 7000),
+    }
+
+
+def build_dict(count: int) -> List[DictUser]:
+    """ count DictUser instances
+    """
+    return [DictUser(**attributes(i)) for i in range(count)]
+
+
+def build_slots(count: int) -> List[User]:
+    """ count User instances
+    """
+    return [User(**attributes(i)) for i in range(count)]
+
+
+def build_store(count: int) -> Dict[str, User]:
+    """ count User instances in DATA, indexed
+    """
+    DATA['User'] = {}
+    INDEXES.pop('User', None)
+    User.indexes()
+    for i in range(count):
+        user = User(**attributes(i))
+        User.index_object(user)
+        DATA['User'][user.id] = user
+    return DATA['User']
+
+
+def measure(build: Callable, count: int) -> dict:
+    """ Memory traced (and time taken) while building count users
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    kept = build(count)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    DATA.pop('User', None)
+    INDEXES.pop('User', None)
+    return {"bytes": current, "peak": peak, "seconds": elapsed}
+
+
+LAYOUTS = {"dict": build_dict, "slots": build_slots, "store": build_store}
+
+
+def main():
+    """ Run the benchmark and print one line per layout
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=1000000)
+    parser.add_argument("--layout", choices=sorted(LAYOUTS), action="append")
+    args = parser.parse_args()
+    layouts = args.layout or ["dict", "slots", "store"]
+    print("{:<6} {:>10} {:>10} {:>10} {:>8}".format(
+        "layout", "MiB", "peak MiB", "B/user", "seconds"))
+    for name in layouts:
+        result = measure(LAYOUTS[name], args.count)
+        print("{:<6} {:>10.1f} {:>10.1f} {:>10.0f} {:>8.1f}".format(
+            name, result["bytes"] / 2 ** 20, result["peak"] / 2 ** 20,
+            result["bytes"] / args.count, result["seconds"]))
+
+
+if __name__ == "__main__":
+    main()
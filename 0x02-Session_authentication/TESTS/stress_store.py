@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+""" Multi-threaded stress test of the User store
+
+Reader threads search (by email, by name, everything), get and count,
+writer threads create, update and remove users, and one thread writes
+snapshots, all for --seconds. Reports the operations per second of each
+kind, the errors raised (e.g. "dictionary changed size during iteration")
+and whether, at the end, DATA and the indexes agree and the store reloaded
+from disk matches DATA (no write that returned was lost). Run it in a
+scratch directory for the .db_User.json it writes, in the default file
+mode and with the other storage settings, e.g.:
+    PYTHONPATH=/path/to/project python3 TESTS/stress_store.py --writers 6
+    GROUP_COMMIT_MS=50 PYTHONPATH=... python3 TESTS/stress_store.py
+    STORAGE_BACKEND=journal PYTHONPATH=... python3 TESTS/stress_store.py
+"""
+import argparse
+import random
+import threading
+import time
+from collections import Counter
+from typing import Callable, List
+
+from models.base import DATA
+from models.index import SortedIndex
+from models.user import User
+
+
+def reader(rng: random.Random) -> str:
+    """ One read operation; returns its kind
+    """
+    kind = rng.choice(("email", "names", "all", "get", "count"))
+    if kind == "email":
+        User.search({"email": "user{}@example.com".format(rng.randrange(500))})
+    elif kind == "names":
+        User.search({"first_name": "F{}".format(rng.randrange(20)),
+                     "last_name": "L{}".format(rng.randrange(20))})
+    elif kind == "all":
+        User.all()
+    elif kind == "get":
+        ids = list(DATA["User"].keys())
+        if ids:
+            User.get(rng.choice(ids))
+    else:
+        User.count()
+    return kind
+
+
+def writer(rng: random.Random) -> str:
+    """ One write operation; returns its kind
+    """
+    kind = rng.choice(("create", "update", "remove"))
+    users = User.search({"email": "user{}@example.com".format(
+        rng.randrange(500))}, limit=1)
+    if kind == "create" or not users:
+        user = User(email="user{}@example.com".format(rng.randrange(500)),
+                    first_name="F{}".format(rng.randrange(20)),
+                    last_name="L{}".format(rng.randrange(20)))
+        user.save()
+        return "create"
+    if kind == "update":
+        users[0].first_name = "F{}".format(rng.randrange(20))
+        users[0].save()
+    else:
+        users[0].remove()
+    return kind
+
+
+def snapshotter(rng: random.Random) -> str:
+    """ One snapshot of the store
+    """
+    User.write_snapshot()
+    time.sleep(0.01)
+    return "snapshot"
+
+
+def check_indexes() -> List[str]:
+    """ Differences between DATA and the indexes of User
+    """
+    problems = []
+    users = list(DATA["User"].values())
+    for index in User.indexes():
+        if isinstance(index, SortedIndex):
+            expected = sorted((getattr(user, index.attribute), user.id)
+                              for user in users
+                              if getattr(user, index.attribute) is not None)
+            if [entry[:2] for entry in index._entries] != expected:
+                problems.append("{} holds {} objects out of order or stale, "
+                                "DATA {}".format(index, len(index),
+                                                 len(expected)))
+            continue
+        keys = {}
+        for user in users:
+            key = {a: getattr(user, a) for a in index.attributes}
+            if user.id not in index.bucket(key):
+                problems.append("{} misses {}".format(index, user.id))
+            keys[tuple(key.values())] = key
+        indexed = sum(len(index.bucket(key)) for key in keys.values())
+        if indexed != len(users) or len(index._keys) != len(users):
+            problems.append("{} holds {} objects, DATA {}".format(
+                index, len(index._keys), len(users)))
+    return problems
+
+
+def check_disk() -> List[str]:
+    """ Differences between DATA and the store reloaded from disk, once
+    the pending writes are committed
+    """
+    User.flush()
+    while User.journal().compacting:
+        time.sleep(0.01)
+    memory = {obj_id: user.to_json(True)
+              for obj_id, user in DATA["User"].items()}
+    User.load_from_file()
+    disk = {obj_id: user.to_json(True)
+            for obj_id, user in DATA["User"].items()}
+    problems = []
+    for obj_id in sorted(memory.keys() | disk.keys()):
+        if obj_id not in disk:
+            problems.append("{} missing on disk".format(obj_id))
+        elif obj_id not in memory:
+            problems.append("{} removed but still on disk".format(obj_id))
+        elif memory[obj_id] != disk[obj_id]:
+            problems.append("{} stale on disk".format(obj_id))
+    return problems
+
+
+def main():
+    """ Run the stress test and print the results
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--users", type=int, default=2000)
+    args = parser.parse_args()
+
+    User.load_from_file()
+    for i in range(args.users):
+        user = User(email="user{}@example.com".format(i % 500),
+                    first_name="F{}".format(i % 20),
+                    last_name="L{}".format(i % 20))
+        DATA["User"][user.id] = user
+    for index in User.indexes():
+        index.rebuild(DATA["User"].values())
+
+    counts = Counter()
+    errors = Counter()
+    lock = threading.Lock()
+    stop = time.monotonic() + args.seconds
+
+    def loop(operation: Callable, seed: int):
+        """ Run operation until the end of the test
+        """
+        rng = random.Random(seed)
+        done = Counter()
+        failed = Counter()
+        while time.monotonic() < stop:
+            try:
+                done[operation(rng)] += 1
+            except Exception as e:
+                failed["{}: {}".format(type(e).__name__, e)] += 1
+        with lock:
+            counts.update(done)
+            errors.update(failed)
+
+    threads = [threading.Thread(target=loop, args=(reader, i))
+               for i in range(args.readers)]
+    threads += [threading.Thread(target=loop, args=(writer, 1000 + i))
+                for i in range(args.writers)]
+    threads.append(threading.Thread(target=loop, args=(snapshotter, -1)))
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    for kind, n in sorted(counts.items()):
+        print("{:<9} {:>9} ops {:>10.0f} ops/s".format(kind, n, n / elapsed))
+    print("total     {:>9} ops {:>10.0f} ops/s".format(
+        sum(counts.values()), sum(counts.values()) / elapsed))
+    for error, n in errors.most_common():
+        print("error     {:>9} x {}".format(n, error))
+    problems = check_indexes()
+    for problem in problems[:10]:
+        print("index    ", problem)
+    users = len(DATA["User"])
+    lost = check_disk()
+    print("disk      {} users in DATA, {} differ on disk".format(
+        users, len(lost)))
+    for problem in lost[:10]:
+        print("disk     ", problem)
+    print("OK" if not errors and not problems and not lost else "FAILED")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@ from flask import Flask, jsonify, abort, request
 from flask_cors import (CORS, cross_origin)
 import os
 
+from api.v1.auth.admission import AdmissionRejected
 from api.v1.auth.auth import Auth
 from api.v1.auth.basic_auth import BasicAuth
 from api.v1.auth.session_auth import SessionAuth
@@ -15,7 +16,8 @@ from api.v1.auth.session_exp_auth import SessionExpAuth
 
 app = Flask(__name__)
 app.register_blueprint(app_views)
-CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
+CORS(app, resources={r"/api/v1/*": {"origins": "*",
+                                    "expose_headers": ["X-Next-Cursor"]}})
 auth = None
 auth_type = getenv('AUTH_TYPE', 'auth')
 if auth_type == 'auth':
@@ -48,6 +50,14 @@ def forbidden(error) -> str:
     return jsonify({"error": "Forbidden"}), 403
 
 
+@app.errorhandler(AdmissionRejected)
+def saturated(error) -> str:
+    """ Password hashing saturated handler
+    """
+    return jsonify({"error": "Service Unavailable"}), 503, \
+        {"Retry-After": str(error.retry_after)}
+
+
 @app.before_request
 def authenticate_user():
     """Authenticates a user before processing a request.
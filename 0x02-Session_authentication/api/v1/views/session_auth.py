@@ -2,6 +2,7 @@
 """
 Flask view that handles all routes for the Session authentication.
 """
+from api.v1.auth.admission import hashing_admission
 from api.v1.views import app_views
 from flask import abort, jsonify, request
 from typing import Tuple
@@ -10,6 +11,7 @@ import os
 
 
 @app_views.route('/auth_session/login', methods=['POST'], strict_slashes=False)
+@hashing_admission.limit
 def session_login() -> Tuple[str, int]:
     """
     - use request.form.get() to retrieve email and password parameters
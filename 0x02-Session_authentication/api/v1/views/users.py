@@ -2,18 +2,86 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from datetime import datetime
+from flask import Response, abort, jsonify, request
+from models.base import TIMESTAMP_FORMAT
 from models.user import User
+from typing import Iterator
+
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH = 500
+
+
+def stream_users(fmt: str) -> Iterator[str]:
+    """ Every User JSON represented, page by page in id order, as NDJSON
+    lines or as the chunks of one JSON array
+    """
+    after = None
+    first = True
+    if fmt == "json":
+        yield "["
+    while True:
+        users, after = User.page(STREAM_BATCH, after)
+        for user in users:
+            line = user.to_json_string()
+            if fmt == "ndjson":
+                yield line + "\n"
+            else:
+                yield line if first else "," + line
+            first = False
+        if after is None:
+            break
+    if fmt == "json":
+        yield "]\n"
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters (optional):
+      - limit: page size (1 to MAX_PAGE_SIZE), users in id order
+      - cursor: X-Next-Cursor header of the previous page
+      - stream: "ndjson" or "json" to stream every user
+      - updated_since: timestamp (2024-01-31T12:00:00, UTC) to only list
+      the users updated since then, oldest update first
     Return:
       - list of all User objects JSON represented
+      - with limit, one page of them; the X-Next-Cursor header is set
+      unless it is the last page
+      - 400 if a parameter is invalid
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    updated_since = request.args.get('updated_since')
+    if updated_since is not None:
+        try:
+            since = datetime.strptime(updated_since, TIMESTAMP_FORMAT)
+        except ValueError:
+            return jsonify({'error': "updated_since must be formatted as "
+                            "2024-01-31T12:00:00"}), 400
+        users = User.range('updated_at', since)
+        return jsonify([user.to_json() for user in users])
+    stream = request.args.get('stream')
+    if stream is not None:
+        if stream not in ("ndjson", "json"):
+            return jsonify({'error': "stream must be ndjson or json"}), 400
+        mimetype = "application/x-ndjson" if stream == "ndjson" \
+            else "application/json"
+        return Response(stream_users(stream), mimetype=mimetype)
+    limit = request.args.get('limit')
+    if limit is None:
+        all_users = [user.to_json() for user in User.all()]
+        return jsonify(all_users)
+    try:
+        limit = int(limit)
+    except ValueError:
+        limit = 0
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        return jsonify({'error': "limit must be between 1 and {}".format(
+            MAX_PAGE_SIZE)}), 400
+    users, cursor = User.page(limit, request.args.get('cursor'))
+    res = jsonify([user.to_json() for user in users])
+    if cursor is not None:
+        res.headers['X-Next-Cursor'] = cursor
+    return res
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
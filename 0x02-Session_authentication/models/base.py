@@ -2,19 +2,118 @@
 """ Base module
 """
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from typing import TypeVar, List, Iterable, Iterator, Optional, Tuple
+from itertools import islice
+from os import getenv, path
+import atexit
+import heapq
 import json
+import os
+import threading
 import uuid
 
+from contextlib import contextmanager
+from models import snapshot
+from models.coherence import Coherence
+from models.group_commit import GroupCommit
+from models.index import Index, SortedIndex
+from models.journal import Journal
+from models.rwlock import RWLock
+
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+JOURNAL_COMPACT_EVERY = 1000
 DATA = {}
+JOURNALS = {}
+INDEXES = {}
+COMMITS = {}
+LOCKS = {}
+SNAPSHOT_LOCKS = {}
+COHERENCES = {}
+JSON_CACHE_STATS = {"hits": 0, "misses": 0}
+_locks_lock = threading.Lock()
+
+
+def storage_backend() -> str:
+    """ Storage backend from the STORAGE_BACKEND environment variable:
+    "file" (default) rewrites .db_<class>.json on every write, "journal"
+    appends each write to .db_<class>.journal and compacts it periodically
+    """
+    return getenv("STORAGE_BACKEND", "file")
+
+
+def group_commit() -> Tuple[float, int]:
+    """ Group commit settings from the environment: GROUP_COMMIT_MS, the
+    longest a write may wait before being committed (0, the default, keeps
+    every write synchronous), and GROUP_COMMIT_MAX, the number of pending
+    writes that triggers a commit right away (default 100)
+    """
+    return (float(getenv("GROUP_COMMIT_MS", "0") or 0),
+            int(getenv("GROUP_COMMIT_MAX", "100") or 100))
+
+
+@atexit.register
+def close_group_commits():
+    """ Commit the pending writes of every class, at exit
+    """
+    for committer in list(COMMITS.values()):
+        committer.close()
+
+
+def storage_shared() -> bool:
+    """ Whether the store is shared by several processes, from the
+    STORAGE_SHARED environment variable ("1" to enable): writes then hold
+    .db_<class>.lock and every process catches up with the changes of the
+    others before reading or writing (group commit is not used)
+    """
+    return getenv("STORAGE_SHARED", "0") == "1"
+
+
+def snapshot_format() -> str:
+    """ Snapshot format from the STORAGE_FORMAT environment variable:
+    "json" (default) for .db_<class>.json, "binary" for the faster to load
+    .db_<class>.bin of models.snapshot (a JSON snapshot is still loaded,
+    and converted on the next write, when no binary one exists)
+    """
+    return getenv("STORAGE_FORMAT", "json")
 
 
 class Base():
     """ Base class
+
+    Subclasses may declare secondary indexes used by search, e.g.
+    __indexes__ = (Index('email'), Index('ssn', unique=True))
+
+    Attributes are stored in __slots__ so that instances do not carry a
+    dictionary; a subclass declares its own attributes in __slots__ too,
+    or gets a __dict__ as usual if it declares none.
+
+    The serialized forms of an object (to_json, to_json_string) are cached
+    in _json_cache until one of its attributes is assigned; an attribute
+    changed in place (e.g. a list appended to) must be assigned again.
     """
+    __slots__ = ('id', 'created_at', 'updated_at', '_json_cache')
+    __indexes__ = ()
+    _indexed_attributes = frozenset()
+    _slot_names = ('id', 'created_at', 'updated_at')
+
+    def __init_subclass__(cls, **kwargs):
+        """ Collect the attributes covered by the declared indexes and the
+        slots of the class, base classes first
+        """
+        super().__init_subclass__(**kwargs)
+        cls._indexed_attributes = frozenset(
+            a for index in cls.__indexes__ for a in index.attributes)
+        names = []
+        for klass in reversed(cls.__mro__):
+            slots = klass.__dict__.get('__slots__', ())
+            if isinstance(slots, str):
+                slots = (slots,)
+            names.extend(n for n in slots
+                         if n not in ('__dict__', '__weakref__',
+                                      '_json_cache') and
+                         n not in names)
+        cls._slot_names = tuple(names)
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
@@ -23,17 +122,40 @@ class Base():
         if DATA.get(s_class) is None:
             DATA[s_class] = {}
 
-        self.id = kwargs.get('id', str(uuid.uuid4()))
-        if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
-        else:
+        self.id = kwargs['id'] if 'id' in kwargs else str(uuid.uuid4())
+        created_at = kwargs.get('created_at')
+        if created_at is None:
             self.created_at = datetime.utcnow()
-        if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+        elif isinstance(created_at, datetime):
+            self.created_at = created_at
         else:
+            self.created_at = datetime.strptime(created_at, TIMESTAMP_FORMAT)
+        updated_at = kwargs.get('updated_at')
+        if updated_at is None:
             self.updated_at = datetime.utcnow()
+        elif isinstance(updated_at, datetime):
+            self.updated_at = updated_at
+        else:
+            self.updated_at = datetime.strptime(updated_at, TIMESTAMP_FORMAT)
+
+    def __setattr__(self, name: str, value):
+        """ Set an attribute, dropping the cached serialized forms and
+        keeping the indexes of a saved object current
+        """
+        object.__setattr__(self, '_json_cache', None)
+        if name not in self._indexed_attributes or \
+                DATA.get(type(self).__name__, {}).get(
+                    getattr(self, 'id', None)) is not self:
+            super().__setattr__(name, value)
+            return
+        with self.__class__.lock().write():
+            old_value = getattr(self, name, None)
+            super().__setattr__(name, value)
+            try:
+                self.__class__.index_object(self)
+            except ValueError:
+                super().__setattr__(name, old_value)
+                raise
 
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
@@ -47,8 +169,37 @@ class Base():
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
         """
+        cache = self._cached_json()
+        result = cache[for_serialization]
+        if result is not None:
+            JSON_CACHE_STATS["hits"] += 1
+            return dict(result)
+        JSON_CACHE_STATS["misses"] += 1
+        result = self._build_json(for_serialization)
+        cache[for_serialization] = result
+        return dict(result)
+
+    def to_json_string(self, for_serialization: bool = False) -> str:
+        """ JSON text of to_json(for_serialization)
+        """
+        cache = self._cached_json()
+        text = cache[2 + for_serialization]
+        if text is not None:
+            JSON_CACHE_STATS["hits"] += 1
+            return text
+        JSON_CACHE_STATS["misses"] += 1
+        result = cache[for_serialization]
+        if result is None:
+            result = self._build_json(for_serialization)
+        text = json.dumps(result)
+        cache[2 + for_serialization] = text
+        return text
+
+    def _build_json(self, for_serialization: bool) -> dict:
+        """ JSON dictionary of the object, uncached
+        """
         result = {}
-        for key, value in self.__dict__.items():
+        for key, value in self._items():
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
@@ -57,56 +208,339 @@ class Base():
                 result[key] = value
         return result
 
+    def _cached_json(self) -> list:
+        """ Cache of the serialized forms: the dictionaries then the texts,
+        public and for serialization; attached before they are built so
+        that an assignment meanwhile detaches it
+        """
+        cache = getattr(self, '_json_cache', None)
+        if cache is None:
+            cache = [None, None, None, None]
+            object.__setattr__(self, '_json_cache', cache)
+        return cache
+
+    def _items(self) -> Iterator[Tuple[str, object]]:
+        """ (name, value) of every attribute set on the object: its slots in
+        declaration order, then its __dict__ if it has one
+        """
+        for name in self._slot_names:
+            try:
+                yield name, getattr(self, name)
+            except AttributeError:
+                continue
+        extra = getattr(self, '__dict__', None)
+        if extra:
+            yield from extra.items()
+
     @classmethod
     def load_from_file(cls):
-        """ Load all objects from file
+        """ Load all objects from file, then replay the journal over them;
+        the loaded objects replace the current ones at once
+        """
+        coherence = cls.coherence()
+        if coherence is None:
+            cls._load()
+            return
+        with coherence.lock.hold(shared=True):
+            cls._load()
+            coherence.record(cls.snapshot_path(), cls.journal().path)
+
+    @classmethod
+    def _load(cls):
+        """ Load all objects from the snapshot and the journal
         """
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
+        bin_path = ".db_{}.bin".format(s_class)
+        objs = {}
+        if snapshot_format() == "binary" and path.exists(bin_path):
+            for obj_id, record in snapshot.load(bin_path).items():
+                objs[obj_id] = cls(**record)
+        elif path.exists(file_path):
+            with open(file_path, 'r') as f:
+                objs_json = json.load(f)
+                for obj_id, obj_json in objs_json.items():
+                    objs[obj_id] = cls(**obj_json)
+
+        for op, obj_id, obj_json in cls.journal().replay():
+            if op == "save":
+                objs[obj_id] = cls(**obj_json)
+            else:
+                objs.pop(obj_id, None)
+        with cls.lock().write():
+            DATA[s_class] = objs
+            INDEXES.pop(s_class, None)
+            cls.indexes()
+
+    @classmethod
+    def snapshot_path(cls) -> str:
+        """ Path of the snapshot written in the configured format
+        """
+        extension = "bin" if snapshot_format() == "binary" else "json"
+        return ".db_{}.{}".format(cls.__name__, extension)
+
+    @classmethod
+    def coherence(cls) -> Optional[Coherence]:
+        """ Coherence of the class with the other processes, None unless
+        the store is shared
+        """
+        if not storage_shared():
+            return None
+        s_class = cls.__name__
+        if COHERENCES.get(s_class) is None:
+            with _locks_lock:
+                if COHERENCES.get(s_class) is None:
+                    COHERENCES[s_class] = Coherence(
+                        ".db_{}.lock".format(s_class))
+        return COHERENCES[s_class]
+
+    @classmethod
+    def refresh(cls):
+        """ Catch up with the changes other processes made to a shared
+        store: read the new journal entries, or reload everything if the
+        snapshot was rewritten
+        """
+        coherence = cls.coherence()
+        if coherence is None:
             return
+        journal = cls.journal()
+        if coherence.changes(cls.snapshot_path(), journal.path) is None:
+            return
+        with coherence.lock.hold(shared=True):
+            change = coherence.changes(cls.snapshot_path(), journal.path)
+            if change == "full":
+                cls._load()
+                coherence.record(cls.snapshot_path(), journal.path)
+                coherence.reloads += 1
+            elif change == "journal":
+                entries, offset = journal.read_from(coherence.offset)
+                cls.apply(entries)
+                coherence.caught_up(journal.path, offset)
+                coherence.catch_ups += 1
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def apply(cls, entries: List[Tuple[str, str, dict]]):
+        """ Apply journal entries (op, id, object JSON) to the store
+        """
+        s_class = cls.__name__
+        with cls.lock().write():
+            for op, obj_id, obj_json in entries:
+                for index in cls.indexes():
+                    index.discard(obj_id)
+                if op == "save":
+                    obj = cls(**obj_json)
+                    cls.index_object(obj)
+                    DATA[s_class][obj_id] = obj
+                else:
+                    DATA[s_class].pop(obj_id, None)
+
+    @classmethod
+    @contextmanager
+    def shared_write(cls) -> Iterator[None]:
+        """ Hold the store of a shared class for writing during the block,
+        after catching up with the other processes; does nothing unless
+        the store is shared
+        """
+        coherence = cls.coherence()
+        if coherence is None:
+            yield
+            return
+        with coherence.lock.hold():
+            cls.refresh()
+            try:
+                yield
+            finally:
+                coherence.record(cls.snapshot_path(), cls.journal().path)
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
         """
+        cls.write_snapshot()
+        cls.journal().clear()
+
+    @classmethod
+    def write_snapshot(cls):
+        """ Write all objects to .db_<class>.json (or .bin) through a
+        temporary file, so that readers never see a partial snapshot.
+        Snapshots of a class are written one at a time, from the copy of
+        the objects to the replace, so that an older copy never lands over
+        a newer one.
+        """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        with cls.snapshot_lock():
+            with cls.lock().read():
+                objs = list(DATA[s_class].items())
+            if snapshot_format() == "binary":
+                snapshot.dump({obj_id: dict(obj._items()) for obj_id, obj
+                               in objs}, ".db_{}.bin".format(s_class))
+                return
+            file_path = ".db_{}.json".format(s_class)
+            text = ", ".join("{}: {}".format(json.dumps(obj_id),
+                                             obj.to_json_string(True))
+                             for obj_id, obj in objs)
+
+            tmp_path = "{}.{}.{}.tmp".format(file_path, os.getpid(),
+                                             threading.get_ident())
+            with open(tmp_path, 'w') as f:
+                f.write("{" + text + "}")
+            os.replace(tmp_path, file_path)
+
+    @classmethod
+    def journal(cls) -> Journal:
+        """ Journal of the class, .db_<class>.journal
+        """
+        s_class = cls.__name__
+        if JOURNALS.get(s_class) is None:
+            JOURNALS[s_class] = Journal(".db_{}.journal".format(s_class))
+        return JOURNALS[s_class]
+
+    @classmethod
+    def lock(cls) -> RWLock:
+        """ Reader-writer lock guarding the objects and indexes of the class:
+        searches read, saves and removals write (persistence runs outside,
+        snapshots under snapshot_lock)
+        """
+        s_class = cls.__name__
+        if LOCKS.get(s_class) is None:
+            with _locks_lock:
+                if LOCKS.get(s_class) is None:
+                    LOCKS[s_class] = RWLock()
+        return LOCKS[s_class]
+
+    @classmethod
+    def snapshot_lock(cls) -> threading.Lock:
+        """ Lock serializing the snapshot writes of the class
+        """
+        s_class = cls.__name__
+        if SNAPSHOT_LOCKS.get(s_class) is None:
+            with _locks_lock:
+                if SNAPSHOT_LOCKS.get(s_class) is None:
+                    SNAPSHOT_LOCKS[s_class] = threading.Lock()
+        return SNAPSHOT_LOCKS[s_class]
+
+    @classmethod
+    def indexes(cls) -> List[Index]:
+        """ Live indexes of the class, built from its __indexes__
+        """
+        s_class = cls.__name__
+        if INDEXES.get(s_class) is None:
+            INDEXES[s_class] = [index.copy() for index in cls.__indexes__]
+            for index in INDEXES[s_class]:
+                index.rebuild(DATA.get(s_class, {}).values())
+        return INDEXES[s_class]
+
+    @classmethod
+    def index_object(cls, obj: TypeVar('Base')):
+        """ Add or move obj in every index of the class
+        """
+        for index in cls.indexes():
+            index.add(obj)
+
+    @classmethod
+    def group_commit(cls) -> Optional[GroupCommit]:
+        """ GroupCommit of the class, None when group commit is disabled
+        """
+        s_class = cls.__name__
+        if COMMITS.get(s_class) is None:
+            interval_ms, max_pending = group_commit()
+            if interval_ms <= 0:
+                return None
+            COMMITS[s_class] = GroupCommit(cls.commit, interval_ms,
+                                           max_pending)
+        return COMMITS[s_class]
+
+    @classmethod
+    def persist(cls, op: str, obj: TypeVar('Base')) -> int:
+        """ Persist one save or remove with the configured backend, now or
+        with the next group commit; returns the generation of the write
+        to wait for (0 once written)
+        """
+        committer = None if storage_shared() else cls.group_commit()
+        if storage_backend() == "journal":
+            obj_json = obj.to_json(True) if op == "save" else None
+            cls.journal().append(op, obj.id, obj_json,
+                                 buffered=committer is not None)
+        if committer is not None:
+            return committer.mark()
+        cls.commit()
+        return 0
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def commit(cls):
+        """ Write the changes of the class with the configured backend
+        """
+        if storage_backend() != "journal":
+            cls.save_to_file()
+            return
+        journal = cls.journal()
+        journal.flush()
+        if journal.entries >= JOURNAL_COMPACT_EVERY and \
+                not journal.compacting:
+            journal.compacting = True
+            threading.Thread(target=cls.compact, daemon=True).start()
+
+    @classmethod
+    def flush(cls):
+        """ Commit the pending writes of the class now
+        """
+        committer = cls.group_commit()
+        if committer is not None:
+            committer.flush()
 
-    def save(self):
-        """ Save current object
+    @classmethod
+    def compact(cls):
+        """ Fold the journal into the snapshot: rotate the journal, write a
+        snapshot of the objects (which covers the rotated entries) and drop
+        the rotated journal. Writes go on to the new journal meanwhile.
+        """
+        journal = cls.journal()
+        try:
+            with cls.shared_write():
+                journal.rotate()
+                cls.write_snapshot()
+                journal.drop_rotated()
+        finally:
+            journal.compacting = False
+
+    def save(self, durable: bool = False):
+        """ Save current object; with group commit, durable waits until the
+        write is on disk
         """
         s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        with self.__class__.shared_write():
+            with self.__class__.lock().write():
+                self.updated_at = datetime.utcnow()
+                self.__class__.index_object(self)
+                DATA[s_class][self.id] = self
+            generation = self.__class__.persist("save", self)
+        if durable and generation:
+            self.__class__.group_commit().sync(generation)
 
-    def remove(self):
-        """ Remove object
+    def remove(self, durable: bool = False):
+        """ Remove object; with group commit, durable waits until the
+        removal is on disk
         """
         s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        with self.__class__.shared_write():
+            with self.__class__.lock().write():
+                if DATA[s_class].get(self.id) is None:
+                    return
+                del DATA[s_class][self.id]
+                for index in self.__class__.indexes():
+                    index.discard(self.id)
+            generation = self.__class__.persist("remove", self)
+        if durable and generation:
+            self.__class__.group_commit().sync(generation)
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
         s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        cls.refresh()
+        with cls.lock().read():
+            return len(DATA[s_class].keys())
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -119,19 +553,111 @@ class Base():
         """ Return one object by ID
         """
         s_class = cls.__name__
-        return DATA[s_class].get(id)
+        cls.refresh()
+        with cls.lock().read():
+            return DATA[s_class].get(id)
 
     @classmethod
-    def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
-        """ Search all objects with matching attributes
+    def plan(cls, attributes: dict) -> Tuple[Iterable, dict]:
+        """ Candidates for a query and the attributes left to check on them
+
+        Among the indexes covering the query, the one holding the fewest
+        objects for its key wins (the widest one on a tie); its attributes
+        are then known to match. Without a usable index, every object is
+        a candidate.
         """
-        s_class = cls.__name__
-        def _search(obj):
-            if len(attributes) == 0:
+        best = None
+        for index in cls.indexes():
+            if not index.covers(attributes):
+                continue
+            bucket = index.bucket(attributes)
+            if bucket is None:
+                continue
+            if best is None or len(bucket) < len(best[1]) or \
+                    (len(bucket) == len(best[1]) and
+                     len(index.attributes) > len(best[0].attributes)):
+                best = (index, bucket)
+        if best is None:
+            return DATA[cls.__name__].values(), attributes
+        index, bucket = best
+        remaining = {k: v for k, v in attributes.items()
+                     if k not in index.attributes}
+        return bucket.values(), remaining
+
+    @classmethod
+    def search(cls, attributes: dict = {},
+               limit: int = None) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes, at most limit ones
+        """
+        cls.refresh()
+        with cls.lock().read():
+            candidates, remaining = cls.plan(attributes)
+            def _search(obj):
+                if len(remaining) == 0:
+                    return True
+                for k, v in remaining.items():
+                    if (getattr(obj, k) != v):
+                        return False
                 return True
-            for k, v in attributes.items():
-                if (getattr(obj, k) != v):
-                    return False
-            return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+
+            return list(islice(filter(_search, candidates), limit))
+
+    @classmethod
+    def sorted_index(cls, attribute: str) -> Optional[SortedIndex]:
+        """ Live SortedIndex of the class over attribute, if declared
+        """
+        for index in cls.indexes():
+            if isinstance(index, SortedIndex) and \
+                    index.attribute == attribute:
+                return index
+        return None
+
+    @classmethod
+    def page(cls, limit: int,
+             after: str = None) -> Tuple[List[TypeVar('Base')], Optional[str]]:
+        """ At most limit objects in id order, starting after the id after,
+        and the id to pass as after for the next page (None on the last
+        page); uses a SortedIndex('id') when the class declares one
+        """
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        cls.refresh()
+        with cls.lock().read():
+            index = cls.sorted_index('id')
+            if index is not None:
+                objs = index.range(after=None if after is None else
+                                   (after, after), limit=limit + 1)
+            else:
+                objs = DATA[cls.__name__]
+                ids = heapq.nsmallest(limit + 1, (
+                    i for i in objs if after is None or i > after))
+                objs = [objs[i] for i in ids]
+        if len(objs) <= limit:
+            return objs, None
+        return objs[:limit], objs[limit - 1].id
+
+    @classmethod
+    def range(cls, field: str, start: datetime = None, end: datetime = None,
+              limit: int = None) -> List[TypeVar('Base')]:
+        """ Objects whose field (e.g. updated_at) is in [start, end), in
+        field then id order, at most limit; uses the SortedIndex of the
+        class over field when it declares one, scans otherwise
+        """
+        cls.refresh()
+        with cls.lock().read():
+            index = cls.sorted_index(field)
+            if index is not None:
+                return index.range(start, end, limit=limit)
+            objs = [obj for obj in DATA[cls.__name__].values()
+                    if getattr(obj, field, None) is not None and
+                    (start is None or getattr(obj, field) >= start) and
+                    (end is None or getattr(obj, field) < end)]
+        objs.sort(key=lambda obj: (getattr(obj, field), obj.id))
+        return objs[:limit]
+
+    @classmethod
+    def first(cls, attributes: dict = {}) -> TypeVar('Base'):
+        """ First object with matching attributes, or None
+        """
+        found = cls.search(attributes, limit=1)
+        return found[0] if found else None
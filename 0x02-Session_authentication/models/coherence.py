@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+""" Coherence module
+"""
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def signature(file_path: str) -> Optional[Tuple[int, int, int, int]]:
+    """ (device, inode, size, mtime in ns) of a file, None if missing
+    """
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class FileLock():
+    """ Lock shared by the processes using the same store: an flock on
+    lock_path, plus a thread lock since flock does not exclude the threads
+    of one process. Reentrant per thread.
+    """
+
+    def __init__(self, lock_path: str):
+        """ Initialize a FileLock on lock_path
+        """
+        if fcntl is None:
+            raise RuntimeError("File locking is not available here")
+        self.lock_path = lock_path
+        self._lock = threading.RLock()
+        self._fd = None
+        self._depth = 0
+
+    @contextmanager
+    def hold(self, shared: bool = False) -> Iterator[None]:
+        """ Hold the lock during the block, shared (for reading) or
+        exclusive; a nested hold keeps the mode of the outer one
+        """
+        with self._lock:
+            if self._depth == 0:
+                if self._fd is None:
+                    self._fd = os.open(self.lock_path,
+                                       os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._fd,
+                            fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class Coherence():
+    """ What a process last saw of a class store on disk: the snapshot
+    signature and how far it read the journal. Tells whether another
+    process changed the store since, and how to catch up:
+    - None: nothing changed
+    - "journal": entries were appended, read them from offset
+    - "full": the snapshot was rewritten (or the journal replaced), reload
+    """
+
+    def __init__(self, lock_path: str):
+        """ Initialize a Coherence guarded by a FileLock on lock_path
+        """
+        self.lock = FileLock(lock_path)
+        self.snapshot = None
+        self.journal = None
+        self.offset = 0
+        self.reloads = 0
+        self.catch_ups = 0
+
+    def record(self, snapshot_path: str, journal_path: str):
+        """ Remember the files as they are now, fully read
+        """
+        self.snapshot = signature(snapshot_path)
+        journal = signature(journal_path)
+        self.journal = journal[:2] if journal else None
+        self.offset = journal[2] if journal else 0
+
+    def changes(self, snapshot_path: str,
+                journal_path: str) -> Optional[str]:
+        """ None, "journal" or "full" (see the class docstring)
+        """
+        if signature(snapshot_path) != self.snapshot:
+            return "full"
+        journal = signature(journal_path)
+        if journal is None:
+            return None if self.journal is None else "full"
+        if self.journal is not None and (journal[:2] != self.journal or
+                                         journal[2] < self.offset):
+            return "full"
+        return "journal" if journal[2] != self.offset else None
+
+    def caught_up(self, journal_path: str, offset: int):
+        """ Remember that the journal was read up to offset
+        """
+        journal = signature(journal_path)
+        self.journal = journal[:2] if journal else None
+        self.offset = offset
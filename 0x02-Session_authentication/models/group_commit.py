@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+""" Group commit module
+"""
+import threading
+import time
+from typing import Callable, Optional
+
+
+class GroupCommit():
+    """ Coalesces the writes of a class store: each change is only marked,
+    and a background thread commits all the marked changes at once, at
+    most interval_ms after the first one or as soon as max_pending are
+    waiting. Every change gets a generation number that callers can wait
+    for to know it is on disk.
+    """
+
+    def __init__(self, commit: Callable[[], None], interval_ms: float,
+                 max_pending: int):
+        """ Initialize a GroupCommit calling commit to write the store
+        """
+        self.commit = commit
+        self.interval = interval_ms / 1000.0
+        self.max_pending = max(1, max_pending)
+        self.pending = 0
+        self.marked = 0
+        self.committed = 0
+        self.commits = 0
+        self.error = None
+        self._cond = threading.Condition()
+        self._commit_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def mark(self) -> int:
+        """ Record one change to commit and return its generation
+        """
+        with self._cond:
+            self.pending += 1
+            self.marked += 1
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run,
+                                                daemon=True)
+                self._thread.start()
+            if self.pending >= self.max_pending:
+                self._cond.notify_all()
+            return self.marked
+
+    def _run(self):
+        """ Flusher thread: commit the pending changes once the interval
+        elapsed or enough of them are waiting
+        """
+        while True:
+            with self._cond:
+                while self.pending == 0 and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                deadline = time.monotonic() + self.interval
+                while self.pending < self.max_pending and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            try:
+                self.flush()
+            except Exception:
+                time.sleep(self.interval)
+
+    def flush(self):
+        """ Commit every change marked so far, now; the exception of a
+        failed commit is kept in error and raised, and the changes stay
+        pending
+        """
+        with self._commit_lock:
+            with self._cond:
+                target = self.marked
+                if self.committed >= target:
+                    return
+                self.pending = 0
+            try:
+                self.commit()
+            except Exception as e:
+                with self._cond:
+                    self.error = e
+                    self.pending = max(self.pending, 1)
+                raise
+            with self._cond:
+                self.committed = max(self.committed, target)
+                self.commits += 1
+                self.error = None
+                self._cond.notify_all()
+
+    def wait(self, generation: Optional[int] = None,
+             timeout: Optional[float] = None) -> bool:
+        """ Wait until the change of generation (by default, the last
+        marked one) is committed; False if timeout expired first
+        """
+        with self._cond:
+            if generation is None:
+                generation = self.marked
+            return self._cond.wait_for(
+                lambda: self.committed >= generation, timeout)
+
+    def sync(self, generation: int):
+        """ Wait until the change of generation is committed, committing it
+        from the calling thread if the flusher did not within two intervals
+        (so that a failing commit raises here instead of blocking)
+        """
+        if not self.wait(generation, 2 * self.interval):
+            self.flush()
+
+    def close(self):
+        """ Commit what is pending and stop the flusher thread
+        """
+        try:
+            self.flush()
+        finally:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+            if self._thread is not None and \
+                    self._thread is not threading.current_thread():
+                self._thread.join()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+""" Index module
+"""
+from bisect import bisect_left, insort
+from operator import attrgetter
+from typing import Dict, Iterable, List, Optional, TypeVar
+
+_MISSING = object()
+
+
+class Index():
+    """ Hash index over one or more attributes of a Base subclass
+
+    Declared on the class (__indexes__ = (Index('email'),)), then kept
+    current by Base.save, Base.remove and attribute assignments so that
+    Base.search can answer equality queries without scanning every object.
+    A unique index refuses two objects with the same key.
+
+    Keys are the attribute value (one attribute) or a tuple of values, and
+    a key held by a single object maps to it directly rather than to a
+    dictionary, which keeps an index over distinct values small.
+    """
+
+    def __init__(self, *attributes: str, unique: bool = False):
+        """ Initialize an Index over attributes
+        """
+        self.attributes = attributes
+        self.unique = unique
+        self._get = attrgetter(*attributes)
+        self._buckets = {}
+        self._keys = {}
+
+    def __repr__(self) -> str:
+        """ Representation
+        """
+        return "Index({}{})".format(", ".join(map(repr, self.attributes)),
+                                    ", unique=True" if self.unique else "")
+
+    def copy(self) -> 'Index':
+        """ Empty index with the same declaration
+        """
+        return Index(*self.attributes, unique=self.unique)
+
+    def key_of(self, obj: TypeVar('Base')):
+        """ Key of an object: the value of the indexed attribute, or the
+        tuple of the values of the indexed attributes
+        """
+        try:
+            return self._get(obj)
+        except AttributeError:
+            if len(self.attributes) == 1:
+                return getattr(obj, self.attributes[0], None)
+            return tuple(getattr(obj, a, None) for a in self.attributes)
+
+    def add(self, obj: TypeVar('Base')):
+        """ Index obj, moving it if its key changed; raises ValueError if
+        a unique index already holds another object with the same key
+        """
+        key = self.key_of(obj)
+        entry = self._buckets.get(key)
+        if self._keys.get(obj.id, _MISSING) == key and entry is not None:
+            if type(entry) is dict:
+                entry[obj.id] = obj
+            else:
+                self._buckets[key] = obj
+            return
+        if self.unique and entry is not None and \
+                (type(entry) is dict or entry.id != obj.id):
+            raise ValueError("Duplicate {} for {}".format(
+                "/".join(self.attributes), key))
+        self.discard(obj.id)
+        entry = self._buckets.get(key)
+        if entry is None:
+            self._buckets[key] = obj
+        elif type(entry) is dict:
+            entry[obj.id] = obj
+        else:
+            self._buckets[key] = {entry.id: entry, obj.id: obj}
+        self._keys[obj.id] = key
+
+    def discard(self, obj_id: str):
+        """ Remove an object from the index, if present
+        """
+        key = self._keys.pop(obj_id, _MISSING)
+        if key is _MISSING:
+            return
+        entry = self._buckets[key]
+        if type(entry) is not dict:
+            del self._buckets[key]
+            return
+        entry.pop(obj_id, None)
+        if len(entry) == 1:
+            self._buckets[key] = next(iter(entry.values()))
+
+    def rebuild(self, objs: Iterable[TypeVar('Base')]):
+        """ Drop every entry and index objs
+        """
+        self._buckets = {}
+        self._keys = {}
+        for obj in objs:
+            self.add(obj)
+
+    def covers(self, attributes: dict) -> bool:
+        """ True if a query on attributes fixes every indexed attribute
+        """
+        return all(a in attributes for a in self.attributes)
+
+    def bucket(self, attributes: dict) -> Optional[Dict[str, TypeVar('Base')]]:
+        """ Objects (by id) whose indexed attributes equal the ones of the
+        query, or None if the query values cannot be looked up (unhashable)
+        """
+        if len(self.attributes) == 1:
+            key = attributes[self.attributes[0]]
+        else:
+            key = tuple(attributes[a] for a in self.attributes)
+        try:
+            entry = self._buckets.get(key)
+        except TypeError:
+            return None
+        if entry is None:
+            return {}
+        return entry if type(entry) is dict else {entry.id: entry}
+
+    def lookup(self, attributes: dict) -> Optional[List[TypeVar('Base')]]:
+        """ Same as bucket, as a list of objects
+        """
+        bucket = self.bucket(attributes)
+        return None if bucket is None else list(bucket.values())
+
+
+class SortedIndex():
+    """ Ordered index over one attribute of a Base subclass
+
+    Keeps (value, id, object) entries sorted, for range scans and stable
+    pagination (by id, by timestamp...). Declared and maintained like
+    Index, but never used for equality searches; objects whose value is
+    None are left out.
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize a SortedIndex over attribute
+        """
+        self.attribute = attribute
+        self.attributes = (attribute,)
+        self.unique = False
+        self._entries = []
+        self._values = {}
+
+    def __repr__(self) -> str:
+        """ Representation
+        """
+        return "SortedIndex({!r})".format(self.attribute)
+
+    def __len__(self) -> int:
+        """ Number of indexed objects
+        """
+        return len(self._entries)
+
+    def copy(self) -> 'SortedIndex':
+        """ Empty index with the same declaration
+        """
+        return SortedIndex(self.attribute)
+
+    def add(self, obj: TypeVar('Base')):
+        """ Index obj, moving it if its value changed
+        """
+        value = getattr(obj, self.attribute, None)
+        if obj.id in self._values and self._values[obj.id] == value:
+            i = bisect_left(self._entries, (value, obj.id))
+            self._entries[i] = (value, obj.id, obj)
+            return
+        self.discard(obj.id)
+        if value is None:
+            return
+        insort(self._entries, (value, obj.id, obj))
+        self._values[obj.id] = value
+
+    def discard(self, obj_id: str):
+        """ Remove an object from the index, if present
+        """
+        if obj_id not in self._values:
+            return
+        value = self._values.pop(obj_id)
+        del self._entries[bisect_left(self._entries, (value, obj_id))]
+
+    def rebuild(self, objs: Iterable[TypeVar('Base')]):
+        """ Drop every entry and index objs
+        """
+        self._entries = []
+        self._values = {}
+        for obj in objs:
+            value = getattr(obj, self.attribute, None)
+            if value is not None:
+                self._entries.append((value, obj.id, obj))
+                self._values[obj.id] = value
+        self._entries.sort(key=lambda entry: entry[:2])
+
+    def covers(self, attributes: dict) -> bool:
+        """ Never used for equality searches
+        """
+        return False
+
+    def range(self, start=None, end=None, after: tuple = None,
+              limit: int = None) -> List[TypeVar('Base')]:
+        """ Objects whose value is in [start, end), in (value, id) order,
+        starting after the (value, id) position after, at most limit
+        """
+        lo = 0
+        if start is not None:
+            lo = bisect_left(self._entries, (start,))
+        if after is not None:
+            i = bisect_left(self._entries, after)
+            if i < len(self._entries) and self._entries[i][:2] == after:
+                i += 1
+            lo = max(lo, i)
+        hi = len(self._entries)
+        if end is not None:
+            hi = bisect_left(self._entries, (end,), lo)
+        if limit is not None:
+            hi = min(hi, lo + limit)
+        return [entry[2] for entry in self._entries[lo:hi]]
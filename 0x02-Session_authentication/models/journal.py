@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+""" Journal module
+"""
+import json
+import os
+import threading
+from typing import Iterator, List, Tuple
+
+
+class Journal():
+    """ Append-only log of the saves and removals of one class, replayed
+    over the JSON snapshot when the class is loaded
+    """
+
+    def __init__(self, path: str):
+        """ Initialize a Journal writing to path
+        """
+        self.path = path
+        self.rotated_path = path + ".old"
+        self.entries = 0
+        self.compacting = False
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    def append(self, op: str, obj_id: str, obj_json: dict = None,
+               buffered: bool = False):
+        """ Append one entry: op is "save" (with the object JSON) or "remove"
+        A buffered entry is only written by the next flush.
+        """
+        entry = {"op": op, "id": obj_id}
+        if obj_json is not None:
+            entry["obj"] = obj_json
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            if buffered:
+                self._buffer.append(line)
+                return
+            self._write(line)
+            self.entries += 1
+
+    def flush(self):
+        """ Write the buffered entries in one append
+        """
+        with self._lock:
+            if not self._buffer:
+                return
+            self._write("".join(self._buffer))
+            self.entries += len(self._buffer)
+            self._buffer = []
+
+    def _write(self, text: str):
+        """ Append complete lines to the journal, after ending a line torn
+        by an interrupted write so that they do not join it
+        """
+        with open(self.path, 'a+b') as f:
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    text = "\n" + text
+            f.write(text.encode("utf-8"))
+
+    def replay(self) -> Iterator[Tuple[str, str, dict]]:
+        """ Yield (op, id, object JSON) for every entry, oldest first,
+        including a journal left rotated by an interrupted compaction;
+        lines torn by an interrupted write are skipped
+        """
+        self.entries = 0
+        for file_path in (self.rotated_path, self.path):
+            if not os.path.exists(file_path):
+                continue
+            with open(file_path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries += 1
+                    yield entry["op"], entry["id"], entry.get("obj")
+
+    def read_from(self, offset: int) -> Tuple[List[Tuple[str, str, dict]],
+                                              int]:
+        """ Entries of the journal written after offset (in bytes), and the
+        offset of the end of the last complete line (torn ones skipped)
+        """
+        entries = []
+        if not os.path.exists(self.path):
+            return entries, offset
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries.append((entry["op"], entry["id"], entry.get("obj")))
+        self.entries += len(entries)
+        return entries, offset
+
+    def rotate(self) -> bool:
+        """ Move the journal aside so that new entries start a fresh file;
+        does nothing if a rotated journal is still waiting for its snapshot
+        """
+        with self._lock:
+            if os.path.exists(self.rotated_path) or \
+                    not os.path.exists(self.path):
+                return False
+            os.replace(self.path, self.rotated_path)
+            self.entries = 0
+            return True
+
+    def drop_rotated(self):
+        """ Delete the rotated journal once a snapshot covers it
+        """
+        if os.path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
+
+    def clear(self):
+        """ Delete every journal file and buffered entry, once a snapshot
+        covers them all
+        """
+        with self._lock:
+            self._buffer = []
+            for file_path in (self.rotated_path, self.path):
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+            self.entries = 0
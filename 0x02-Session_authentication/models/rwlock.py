@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+""" Reader-writer lock module
+"""
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class RWLock():
+    """ Reader-writer lock: any number of readers, or one writer
+
+    Waiting writers go first, so a stream of readers cannot starve them.
+    Both sides are reentrant per thread, and the writer may also read.
+    """
+
+    def __init__(self):
+        """ Initialize an RWLock
+        """
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writes = 0
+        self._waiting_writers = 0
+        self._local = threading.local()
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        """ Hold the lock for reading during the block
+        """
+        me = threading.get_ident()
+        depth = getattr(self._local, 'reads', 0)
+        if depth > 0 or self._writer == me:
+            self._local.reads = depth + 1
+            try:
+                yield
+            finally:
+                self._local.reads = depth
+            return
+        with self._cond:
+            while self._writer is not None or self._waiting_writers > 0:
+                self._cond.wait()
+            self._readers += 1
+        self._local.reads = 1
+        try:
+            yield
+        finally:
+            self._local.reads = 0
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        """ Hold the lock for writing during the block
+        """
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me:
+                if getattr(self._local, 'reads', 0) > 0:
+                    raise RuntimeError("Cannot write while reading")
+                self._waiting_writers += 1
+                try:
+                    while self._writer is not None or self._readers > 0:
+                        self._cond.wait()
+                finally:
+                    self._waiting_writers -= 1
+                self._writer = me
+            self._writes += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writes -= 1
+                if self._writes == 0:
+                    self._writer = None
+                    self._cond.notify_all()
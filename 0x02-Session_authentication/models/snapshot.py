@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+""" Snapshot module
+
+Binary snapshot format of a class store, faster to load than JSON:
+- a header: magic, format version, number of objects, number of columns
+- the object ids, then one column per attribute
+- each column: name, type, one state byte per object (present, None or
+absent), then its values: "t" columns hold epoch seconds (int64), "s"
+columns a UTF-8 blob with the end offset of every string and "j"
+columns the same for JSON-encoded values of any other type
+
+Conversion from/to the JSON snapshot:
+    python3 -m models.snapshot to-binary .db_User.json .db_User.bin
+    python3 -m models.snapshot to-json .db_User.bin .db_User.json
+"""
+from array import array
+from datetime import datetime, timedelta
+from typing import Dict, List
+import json
+import os
+import struct
+import sys
+import threading
+
+
+MAGIC = b"BSNP"
+VERSION = 1
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+TIMESTAMP_FIELDS = ("created_at", "updated_at")
+EPOCH = datetime(1970, 1, 1)
+HEADER = struct.Struct("<4sHII")
+PRESENT, NONE, ABSENT = 0, 1, 2
+
+
+class SnapshotError(ValueError):
+    """ Raised on a file that is not a snapshot this module can read
+    """
+
+
+def _array_bytes(values: array) -> bytes:
+    """ Little-endian bytes of an array
+    """
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _read_array(typecode: str, data: bytes) -> array:
+    """ Array of typecode from little-endian bytes
+    """
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def _column_type(values: list) -> str:
+    """ Type of the column holding values (None and absent ones excluded)
+    """
+    if all(type(v) is datetime for v in values):
+        return "t"
+    if all(type(v) is str for v in values):
+        return "s"
+    return "j"
+
+
+def _pack_strings(strings: List[str]) -> bytes:
+    """ End offsets then UTF-8 blob of strings
+    """
+    ends = array("I")
+    end = 0
+    for s in strings:
+        end += len(s)
+        ends.append(end)
+    blob = "".join(strings).encode("utf-8")
+    return _array_bytes(ends) + struct.pack("<I", len(blob)) + blob
+
+
+def dumps(records: Dict[str, dict]) -> bytes:
+    """ Binary snapshot of records, a dictionary id => attributes where
+    timestamps are datetime instances
+    """
+    ids = list(records.keys())
+    rows = list(records.values())
+    names = []
+    seen = set()
+    for row in rows:
+        for name in row:
+            if name not in seen:
+                seen.add(name)
+                names.append(name)
+
+    chunks = [HEADER.pack(MAGIC, VERSION, len(ids), len(names)),
+              _pack_strings(ids)]
+    for name in names:
+        states = bytearray(len(rows))
+        values = []
+        for i, row in enumerate(rows):
+            if name not in row:
+                states[i] = ABSENT
+            elif row[name] is None:
+                states[i] = NONE
+            else:
+                values.append(row[name])
+        kind = _column_type(values)
+        encoded = name.encode("utf-8")
+        chunks.append(struct.pack("<H", len(encoded)) + encoded +
+                      kind.encode() + bytes(states))
+        if kind == "t":
+            seconds = array("q", (int((v - EPOCH).total_seconds())
+                                  for v in values))
+            chunks.append(_array_bytes(seconds))
+        elif kind == "s":
+            chunks.append(_pack_strings(values))
+        else:
+            chunks.append(_pack_strings([json.dumps(v) for v in values]))
+    return b"".join(chunks)
+
+
+def loads(data: bytes) -> Dict[str, dict]:
+    """ Records of a binary snapshot, timestamps as datetime instances
+    """
+    view = memoryview(data)
+    try:
+        magic, version, count, n_columns = HEADER.unpack_from(view, 0)
+    except struct.error:
+        raise SnapshotError("Truncated snapshot")
+    if magic != MAGIC:
+        raise SnapshotError("Not a binary snapshot")
+    if version != VERSION:
+        raise SnapshotError("Unsupported snapshot version {}".format(version))
+    offset = HEADER.size
+
+    def strings(n: int) -> List[str]:
+        """ Read n strings packed by _pack_strings
+        """
+        nonlocal offset
+        ends = _read_array("I", view[offset:offset + 4 * n])
+        offset += 4 * n
+        size, = struct.unpack_from("<I", view, offset)
+        offset += 4
+        if len(ends) != n or offset + size > len(view):
+            raise SnapshotError("Truncated snapshot")
+        text = bytes(view[offset:offset + size]).decode("utf-8")
+        offset += size
+        starts = [0]
+        starts.extend(ends[:-1])
+        return [text[s:e] for s, e in zip(starts, ends)]
+
+    try:
+        ids = strings(count)
+        names = []
+        columns = []
+        partial = False
+        for _ in range(n_columns):
+            size, = struct.unpack_from("<H", view, offset)
+            offset += 2
+            names.append(bytes(view[offset:offset + size]).decode("utf-8"))
+            offset += size
+            kind = chr(view[offset])
+            states = bytes(view[offset + 1:offset + 1 + count])
+            offset += 1 + count
+            if len(states) != count:
+                raise SnapshotError("Truncated snapshot")
+            n = states.count(PRESENT)
+            if kind == "t":
+                seconds = _read_array("q", view[offset:offset + 8 * n])
+                offset += 8 * n
+                if len(seconds) != n:
+                    raise SnapshotError("Truncated snapshot")
+                values = [EPOCH + timedelta(seconds=s) for s in seconds]
+            elif kind == "s":
+                values = strings(n)
+            elif kind == "j":
+                values = [json.loads(v) for v in strings(n)]
+            else:
+                raise SnapshotError("Unknown column type {!r}".format(kind))
+            if n != count:
+                it = iter(values)
+                values = [next(it) if s == PRESENT else None for s in states]
+                partial = partial or ABSENT in states
+            columns.append((values, states))
+    except SnapshotError:
+        raise
+    except (struct.error, IndexError, ValueError):
+        raise SnapshotError("Truncated snapshot")
+
+    if not partial:
+        rows = zip(*[values for values, _ in columns]) if columns else \
+            ((),) * count
+        return {obj_id: dict(zip(names, row)) for obj_id, row in
+                zip(ids, rows)}
+    records = {}
+    for i, obj_id in enumerate(ids):
+        records[obj_id] = {name: values[i] for name, (values, states) in
+                           zip(names, columns) if states[i] != ABSENT}
+    return records
+
+
+def dump(records: Dict[str, dict], file_path: str):
+    """ Write records to file_path through a temporary file, so that
+    readers never see a partial snapshot
+    """
+    tmp_path = "{}.{}.{}.tmp".format(file_path, os.getpid(),
+                                     threading.get_ident())
+    with open(tmp_path, 'wb') as f:
+        f.write(dumps(records))
+    os.replace(tmp_path, file_path)
+
+
+def load(file_path: str) -> Dict[str, dict]:
+    """ Records of the binary snapshot file_path
+    """
+    with open(file_path, 'rb') as f:
+        return loads(f.read())
+
+
+def from_json(objs_json: Dict[str, dict]) -> Dict[str, dict]:
+    """ Records of a JSON snapshot, with its timestamps parsed
+    """
+    records = {}
+    for obj_id, obj_json in objs_json.items():
+        record = dict(obj_json)
+        for name in TIMESTAMP_FIELDS:
+            if type(record.get(name)) is str:
+                record[name] = datetime.strptime(record[name],
+                                                 TIMESTAMP_FORMAT)
+        records[obj_id] = record
+    return records
+
+
+def to_json(records: Dict[str, dict]) -> Dict[str, dict]:
+    """ JSON snapshot of records, with its timestamps formatted
+    """
+    objs_json = {}
+    for obj_id, record in records.items():
+        objs_json[obj_id] = {
+            name: value.strftime(TIMESTAMP_FORMAT)
+            if type(value) is datetime else value
+            for name, value in record.items()}
+    return objs_json
+
+
+def convert(command: str, src: str, dst: str):
+    """ Convert the snapshot src into dst: command is "to-binary" (JSON
+    to binary) or "to-json" (binary to JSON)
+    """
+    if command == "to-binary":
+        with open(src, 'r') as f:
+            dump(from_json(json.load(f)), dst)
+    elif command == "to-json":
+        with open(dst, 'w') as f:
+            json.dump(to_json(load(src)), f)
+    else:
+        raise ValueError("Unknown command {!r}".format(command))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] not in ("to-binary", "to-json"):
+        print("Usage: python3 -m models.snapshot to-binary|to-json SRC DST",
+              file=sys.stderr)
+        sys.exit(2)
+    try:
+        convert(*sys.argv[1:])
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
@@ -3,11 +3,16 @@
 """
 import hashlib
 from models.base import Base
+from models.index import Index, SortedIndex
 
 
 class User(Base):
     """ User class
     """
+    __slots__ = ('email', '_password', 'first_name', 'last_name')
+    __indexes__ = (Index('email'), Index('first_name', 'last_name'),
+                   SortedIndex('id'), SortedIndex('created_at'),
+                   SortedIndex('updated_at'))
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+admission.py module file.
+"""
+import math
+import os
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterator
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when the hashing capacity is saturated; retry_after is the
+    number of seconds a client should wait before retrying.
+    """
+
+    def __init__(self, retry_after: int):
+        """ Init """
+        super().__init__("Hashing capacity saturated")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Admission control for CPU-bound password hashing routes.
+    - At most max_in_flight requests hash at the same time (a semaphore).
+    - Up to max_queue more requests may wait, each at most timeout seconds.
+    - Anything beyond is rejected right away with AdmissionRejected, so a
+    burst is answered fast instead of queuing unbounded bcrypt work.
+    - in_flight, waiting, admitted and rejected count what happened.
+    """
+
+    def __init__(self, max_in_flight: int = os.cpu_count() or 1,
+                 max_queue: int = 16, timeout: float = 1.0):
+        """ Init """
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        """
+        Build a controller from HASHING_MAX_IN_FLIGHT, HASHING_MAX_QUEUE and
+        HASHING_TIMEOUT, keeping the defaults for the unset ones.
+        """
+        kwargs = {}
+        settings = (("max_in_flight", "HASHING_MAX_IN_FLIGHT", int),
+                    ("max_queue", "HASHING_MAX_QUEUE", int),
+                    ("timeout", "HASHING_TIMEOUT", float))
+        for key, name, cast in settings:
+            if os.getenv(name):
+                kwargs[key] = cast(os.getenv(name))
+        return cls(**kwargs)
+
+    def _reject(self) -> AdmissionRejected:
+        """ Count a rejection and build the exception to raise """
+        with self._lock:
+            self.rejected += 1
+        return AdmissionRejected(max(1, math.ceil(self.timeout)))
+
+    @contextmanager
+    def admit(self) -> Iterator[None]:
+        """
+        Hold one hashing slot for the duration of the block, waiting in
+        the bounded queue if needed, or raise AdmissionRejected.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                full = self.waiting >= self.max_queue
+                if not full:
+                    self.waiting += 1
+            if full:
+                raise self._reject()
+            try:
+                acquired = self._slots.acquire(timeout=self.timeout)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+            if not acquired:
+                raise self._reject()
+        with self._lock:
+            self.in_flight += 1
+            self.admitted += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def limit(self, view: Callable) -> Callable:
+        """ Decorator running a view inside admit() """
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            """ Admitted call of the view """
+            with self.admit():
+                return view(*args, **kwargs)
+        return wrapper
+
+    def snapshot(self) -> dict:
+        """ Return the current counters as a dictionary """
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
@@ -3,12 +3,24 @@
 Setting up a basic Flask app.
 """
 from flask import Flask, jsonify, request, abort, redirect
+from admission import AdmissionController, AdmissionRejected
 from auth import Auth
 
 AUTH = Auth()
+ADMISSION = AdmissionController.from_env()
 app = Flask(__name__)
 
 
+@app.errorhandler(AdmissionRejected)
+def saturated(error: AdmissionRejected):
+    """
+    Answer 503 with a Retry-After header when the password hashing routes
+    are saturated.
+    """
+    return jsonify({"message": "server busy"}), 503, \
+        {"Retry-After": str(error.retry_after)}
+
+
 @app.route('/')
 def hello():
     """
@@ -19,6 +31,7 @@ def hello():
 
 
 @app.route("/users", methods=["POST"])
+@ADMISSION.limit
 def register_user():
     """
     - Implement the end-point to register a user. Define a users function that
@@ -43,6 +56,7 @@ def register_user():
 
 
 @app.route("/sessions", methods=["POST"])
+@ADMISSION.limit
 def login():
     """
     - Implement a login function to respond to the POST /sessions route.
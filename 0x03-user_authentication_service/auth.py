@@ -3,24 +3,111 @@
 auth.py module file.
 """
 import bcrypt
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from sqlalchemy.orm.exc import NoResultFound
 from uuid import uuid4
-from typing import Union
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
 
 from db import DB
 from user import User
 
+DEFAULT_ROUNDS = 12
+MIN_ROUNDS = 4
+MAX_ROUNDS = 16
+TARGET_HASH_MS = 250.0
+BATCH_CHUNK_SIZE = 64
+_rounds = None
+
 
 def _hash_password(password: str) -> bytes:
     """
     Hashes the input password using bcrypt and returns the salted hash as
     bytes
     """
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(bcrypt_rounds())
     hashed_bytes = bcrypt.hashpw(password.encode("utf-8"), salt)
     return hashed_bytes
 
 
+def bcrypt_rounds() -> int:
+    """
+    Return the bcrypt cost factor used by _hash_password: the BCRYPT_ROUNDS
+    environment variable if set, else the value chosen by the last
+    calibrate_rounds call, else DEFAULT_ROUNDS (bcrypt's own default).
+    """
+    env = os.environ.get("BCRYPT_ROUNDS")
+    if env:
+        return int(env)
+    return _rounds if _rounds is not None else DEFAULT_ROUNDS
+
+
+def calibrate_rounds(target_ms: float = TARGET_HASH_MS) -> int:
+    """
+    Pick the highest cost factor whose hashing time on this machine stays
+    within target_ms (each round doubles the work, so it is predicted from
+    one hash at MIN_ROUNDS, then checked), cache it and return it.
+    """
+    global _rounds
+
+    def elapsed_ms(rounds: int) -> float:
+        """ Time one hash at `rounds` """
+        start = time.perf_counter()
+        bcrypt.hashpw(b"calibration", bcrypt.gensalt(rounds))
+        return (time.perf_counter() - start) * 1000
+
+    base = elapsed_ms(MIN_ROUNDS)
+    rounds = MIN_ROUNDS
+    while rounds < MAX_ROUNDS and base * 2 ** (rounds + 1 - MIN_ROUNDS) \
+            <= target_ms:
+        rounds += 1
+    while rounds > MIN_ROUNDS and elapsed_ms(rounds) > target_ms:
+        rounds -= 1
+    _rounds = rounds
+    return rounds
+
+
+def _needs_rehash(hashed_password: bytes) -> bool:
+    """
+    Tell whether a bcrypt hash ($2b$<cost>$...) was made with a lower cost
+    factor than the current bcrypt_rounds(); a higher one is kept, so that
+    workers calibrated differently never rewrite each other's hashes.
+    """
+    return int(hashed_password.split(b"$")[2]) < bcrypt_rounds()
+
+
+def _hash_passwords(passwords: Iterable[str],
+                    chunk_size: int = BATCH_CHUNK_SIZE,
+                    workers: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Hash `passwords` like _hash_password on a pool of worker processes and
+    yield the hashes in input order. The input is read chunk_size passwords
+    at a time with at most two chunks per worker in flight.
+    """
+    workers = workers or os.cpu_count() or 1
+    items = ((p, bcrypt_rounds()) for p in passwords)
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            while len(pending) < 2 * workers:
+                chunk = list(islice(items, chunk_size))
+                if not chunk:
+                    break
+                pending.append(pool.submit(_hash_chunk, chunk))
+            if not pending:
+                return
+            yield from pending.popleft().result()
+
+
+def _hash_chunk(items: List[Tuple[str, int]]) -> List[bytes]:
+    """ Hash a chunk of (password, rounds) in a worker process """
+    return [bcrypt.hashpw(p.encode("utf-8"), bcrypt.gensalt(r))
+            for p, r in items]
+
+
 def _generate_uuid() -> str:
     """
     Implement a _generate_uuid function in the auth module. The function should
@@ -49,6 +136,48 @@ class Auth:
             return self._db.add_user(email, _hash_password(password))
         raise ValueError("User {} already exists".format(email))
 
+    def register_users(self, credentials: Iterable[Tuple[str, str]],
+                       chunk_size: int = BATCH_CHUNK_SIZE) -> List[User]:
+        """
+        Bulk version of register_user for imports: registers every
+        (email, password) pair whose email is not taken yet (earlier in the
+        batch included), hashing the passwords in parallel with
+        _hash_passwords. Returns the created User objects in input order;
+        iter_register_users does the same without keeping them.
+        """
+        return list(self.iter_register_users(credentials, chunk_size))
+
+    def iter_register_users(self, credentials: Iterable[Tuple[str, str]],
+                            chunk_size: int = BATCH_CHUNK_SIZE
+                            ) -> Iterator[User]:
+        """
+        Streaming register_users: credentials are read only as fast as the
+        passwords are hashed, each user is added as its hash arrives and
+        yielded, so memory stays bounded by the chunks in flight whatever
+        the size of the import. Nothing is registered until iterated.
+        """
+        emails = deque()
+        in_flight = set()
+
+        def new_passwords() -> Iterator[str]:
+            """ Passwords of the new emails, queuing the emails in order """
+            for email, password in credentials:
+                if email in in_flight:
+                    continue
+                try:
+                    self._db.find_user_by(email=email)
+                except NoResultFound:
+                    emails.append(email)
+                    in_flight.add(email)
+                    yield password
+
+        for hashed_password in _hash_passwords(new_passwords(), chunk_size):
+            email = emails.popleft()
+            user = self._db.add_user(email, hashed_password)
+            in_flight.discard(email)
+            if user is not None:
+                yield user
+
     def valid_login(self, email: str, password: str) -> bool:
         """
         - Implement the Auth.valid_login method. It should expect email and
@@ -56,15 +185,21 @@ class Auth:
         - Try locating the user by email. If it exists, check the password with
         bcrypt.checkpw. If it matches return True. In any other case,
         return False.
+        - A matching password whose hash uses a lower cost factor than the
+        current one is transparently rehashed at the current one.
         """
         user = None
         try:
             user = self._db.find_user_by(email=email)
             if user is not None:
-                return bcrypt.checkpw(
+                valid = bcrypt.checkpw(
                     password.encode("utf-8"),
                     user.hashed_password,
                 )
+                if valid and _needs_rehash(user.hashed_password):
+                    self._db.update_user(
+                        user.id, hashed_password=_hash_password(password))
+                return valid
         except NoResultFound:
             return False
         return False